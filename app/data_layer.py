@@ -0,0 +1,143 @@
+import threading
+import time
+
+import arrow
+import polars as pl
+
+import logging
+
+from pipeline_instrumentation import PipelineInstrumentation
+from http_transport import HttpTransport
+from historic_generation_wrangler import HistoricGenerationWrangler, GenerationStore
+from renewable_locations_wrangler import RenewableLocationsWrangler
+
+logger = logging.getLogger(__name__)
+
+
+class EnergySecurityData:
+
+    def __init__(self, history_days=90, ttl_seconds=3600, generation_store_path=None, repd_cache_dir=None, instrument=False, http_mode='live', cassette_dir=None, retry_seconds=300, end_date=None, transport=None):
+        self.history_days = history_days
+        self.ttl_seconds = ttl_seconds
+
+        # After a failed refresh the sources are left alone for this long, rather than being called again on every rerun
+        self.retry_seconds = retry_seconds
+        self.last_failure_at = None
+        self.generation_store_path = generation_store_path
+        self.repd_cache_dir = repd_cache_dir
+        
+        # With instrumentation on, every refresh logs a per stage timing summary
+        self.instrumentation = PipelineInstrumentation(enabled=instrument)
+
+        # One transport for every download, in replay mode the app runs entirely from recorded responses
+        if transport is None:
+            transport = HttpTransport(mode=http_mode, cassette_dir=cassette_dir)
+        self.transport = transport
+
+        # The window ends now unless it is pinned, recordings are keyed by the request so they only replay for a pinned end
+        if end_date is None and self.transport.mode != 'live':
+            raise ValueError(f"end_date must be set to {self.transport.mode} responses, otherwise every request is for a different window")
+        self.end_date = None if end_date is None else arrow.get(end_date)
+
+        # The current snapshot is swapped in whole, so readers never see a half refreshed set of frames
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+
+        # Only one refresh runs at a time, whether it is the first blocking load or a background refresh
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.last_error = None
+
+    def load_snapshot(self):
+
+        end_date = arrow.utcnow() if self.end_date is None else self.end_date
+        start_date = end_date.shift(days=-self.history_days)
+
+        hgw = HistoricGenerationWrangler(instrumentation=self.instrumentation, transport=self.transport)
+
+        # With a generation store only the readings since the last refresh are downloaded
+        if self.generation_store_path is None:
+            generation_data = hgw.get_generation_data(start_date, end_date, window_days=7)
+        else:
+            store = GenerationStore(self.generation_store_path, hgw)
+            store.update(end_date, start_date=start_date, window_days=7)
+            generation_data = store.read_generation_data(start_date=start_date.date())
+
+        rlw = RenewableLocationsWrangler(cache_dir=self.repd_cache_dir, instrumentation=self.instrumentation, transport=self.transport)
+        renewable_locations = rlw.get_renewable_locations()
+
+        return {
+            'generation_data': generation_data,
+            'aggregated_generation_data': hgw.aggregate_generation_data_by_settlement_date_and_fuel_type(generation_data),
+            'renewable_locations': renewable_locations,
+            'cumulative_installed_capacity': rlw.compute_cumulative_installed_capacity(renewable_locations),
+            'refreshed_at': time.time(),
+            'version': 0 if self.snapshot is None else self.snapshot['version'] + 1,
+        }
+
+    def refresh(self):
+        with self.refresh_lock:
+
+            # Callers queued behind a refresh that has just finished, or failed, do not load again
+            if not self.should_refresh():
+                return
+
+            try:
+                snapshot = self.load_snapshot()
+            except Exception as exception:
+                # Keep serving the previous snapshot if a refresh fails
+                logger.exception("Refreshing energy security data failed")
+                self.last_error = exception
+                self.last_failure_at = time.time()
+                return
+            with self.snapshot_lock:
+                self.snapshot = snapshot
+            self.last_error = None
+            self.last_failure_at = None
+            logger.info(f"Energy security data refreshed to version {snapshot['version']}")
+            if self.instrumentation.enabled:
+                logger.info(f"Refresh stage timings:\n{self.instrumentation.summary()}")
+                self.instrumentation.reset()
+
+    def is_stale(self):
+        return self.snapshot is None or time.time() - self.snapshot['refreshed_at'] > self.ttl_seconds
+
+    def should_refresh(self):
+        if not self.is_stale():
+            return False
+        return self.last_failure_at is None or time.time() - self.last_failure_at > self.retry_seconds
+
+    def start_background_refresh(self):
+        if self.refresh_thread is not None and self.refresh_thread.is_alive():
+            return
+        self.refresh_thread = threading.Thread(target=self.refresh, name='energy-security-refresh', daemon=True)
+        self.refresh_thread.start()
+
+    def get_snapshot(self):
+
+        # The very first caller has to wait for data, everyone else is served the current snapshot immediately
+        if self.snapshot is None:
+            self.refresh()
+            if self.snapshot is None:
+                raise RuntimeError(f"Energy security data could not be loaded: {self.last_error}")
+
+        # A stale snapshot is still returned while a single background thread fetches the next one
+        if self.should_refresh():
+            self.start_background_refresh()
+
+        with self.snapshot_lock:
+            return self.snapshot
+
+
+def compute_wind_data(aggregated_generation_data, cumulative_installed_capacity):
+
+    # Join the cumulative installed capacity to the aggregated wind generation, as in the integrated views notebook
+    return (
+        aggregated_generation_data
+        .filter(pl.col('name') == 'Wind')
+        .join(cumulative_installed_capacity, left_on='settlementDate', right_on='date', how='left')
+        .sort('settlementDate')
+        .with_columns([
+            (pl.col('max_generation') / pl.col('cumulative_installed_capacity_mw')).alias('max_generation_as_percentage_of_installed_capacity'),
+        ])
+    )
@@ -0,0 +1,122 @@
+import logging
+import os
+from datetime import datetime, timezone
+
+import plotly.graph_objects as go
+import polars as pl
+import streamlit as st
+
+from historic_generation_wrangler import HistoricGenerationWrangler
+
+from data_layer import EnergySecurityData, compute_wind_data
+
+# The packages only log through module loggers, the app decides where those go
+logging.basicConfig(level=logging.INFO)
+
+HISTORY_DAYS = int(os.environ.get('ENERGY_SECURITY_HISTORY_DAYS', 90))
+REFRESH_SECONDS = int(os.environ.get('ENERGY_SECURITY_REFRESH_SECONDS', 3600))
+GENERATION_STORE_PATH = os.environ.get('ENERGY_SECURITY_GENERATION_STORE_PATH')
+REPD_CACHE_DIR = os.environ.get('ENERGY_SECURITY_REPD_CACHE_DIR')
+INSTRUMENT = os.environ.get('ENERGY_SECURITY_INSTRUMENT', '').lower() in ('1', 'true', 'yes')
+HTTP_MODE = os.environ.get('ENERGY_SECURITY_HTTP_MODE', 'live')
+CASSETTE_DIR = os.environ.get('ENERGY_SECURITY_CASSETTE_DIR')
+END_DATE = os.environ.get('ENERGY_SECURITY_END_DATE')
+
+
+@st.cache_resource
+def get_data_layer():
+    # One data layer per process, shared by every session and rerun
+    return EnergySecurityData(
+        history_days=HISTORY_DAYS,
+        ttl_seconds=REFRESH_SECONDS,
+        generation_store_path=GENERATION_STORE_PATH,
+        repd_cache_dir=REPD_CACHE_DIR,
+        instrument=INSTRUMENT,
+        http_mode=HTTP_MODE,
+        cassette_dir=CASSETTE_DIR,
+        end_date=END_DATE,
+    )
+
+
+@st.cache_resource
+def get_wrangler():
+    return HistoricGenerationWrangler()
+
+
+# The frames are passed with a leading underscore so Streamlit does not hash them, the snapshot version is the cache key
+@st.cache_data(max_entries=4)
+def get_wind_data(version, _aggregated_generation_data, _cumulative_installed_capacity):
+    return compute_wind_data(_aggregated_generation_data, _cumulative_installed_capacity)
+
+
+@st.cache_data(max_entries=4)
+def get_generation_figure(version, _generation_data):
+    return get_wrangler().plot_generation_data(_generation_data)
+
+
+@st.cache_data(max_entries=16)
+def get_aggregated_generation_figure(version, fuels, statistics, _aggregated_generation_data):
+    return get_wrangler().plot_aggregated_generation_data(_aggregated_generation_data, fuels=fuels, statistics=statistics)
+
+
+def plot_wind_data(wind_data):
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(x=wind_data['settlementDate'], y=wind_data['max_generation_as_percentage_of_installed_capacity'],
+                             mode='lines', name='Max Generation as Percentage of Installed Capacity'))
+
+    fig.add_trace(go.Scatter(x=wind_data['settlementDate'], y=wind_data['max_percentage_of_total_generation'],
+                             mode='lines', name='Max Percentage of Total Generation'))
+
+    fig.update_layout(title='Max Generation as Percentage of Installed Capacity',
+                      xaxis_title='Settlement Date',
+                      yaxis_title='Percentage',
+                      autosize=True,
+                      height=600)
+
+    return fig
+
+
+st.set_page_config(page_title='UK Energy Security', layout='wide')
+st.title('Can wind alone sustain the UK grid?')
+
+data_layer = get_data_layer()
+
+with st.spinner('Loading generation and installed capacity data...'):
+    snapshot = data_layer.get_snapshot()
+
+version = snapshot['version']
+
+st.caption(
+    f"Data refreshed {datetime.fromtimestamp(snapshot['refreshed_at'], tz=timezone.utc):%Y-%m-%d %H:%M} UTC, "
+    f"covering the last {HISTORY_DAYS} days"
+)
+if data_layer.last_error is not None:
+    st.warning(f"The last background refresh failed, showing the previous data: {data_layer.last_error}")
+
+# Widgets only drive the cheap aggregations below, the downloaded data is shared through the data layer
+with st.sidebar:
+    threshold = st.slider('Low wind threshold (max share of total generation)', 0.0, 1.0, 0.1, 0.01)
+    fuels = st.multiselect('Fuel types', options=list(HistoricGenerationWrangler.fuel_order), default=['Wind', 'CCGT', 'Nuclear'])
+    statistics = st.multiselect(
+        'Statistics',
+        options=list(HistoricGenerationWrangler.statistic_line_styles),
+        default=['max_generation', 'median_generation', 'min_generation'],
+    )
+
+wind_data = get_wind_data(version, snapshot['aggregated_generation_data'], snapshot['cumulative_installed_capacity'])
+low_wind_days = wind_data.filter(pl.col('max_percentage_of_total_generation') < threshold)
+
+first_column, second_column, third_column = st.columns(3)
+first_column.metric('Days in range', wind_data.height)
+second_column.metric(f'Days where wind never exceeded {threshold:.0%} of generation', low_wind_days.height)
+third_column.metric('Installed wind capacity (MW)', f"{snapshot['cumulative_installed_capacity']['cumulative_installed_capacity_mw'].max():,.0f}")
+
+st.plotly_chart(plot_wind_data(wind_data), use_container_width=True)
+
+st.plotly_chart(
+    get_aggregated_generation_figure(version, tuple(fuels), tuple(statistics), snapshot['aggregated_generation_data']),
+    use_container_width=True,
+)
+
+st.plotly_chart(get_generation_figure(version, snapshot['generation_data']), use_container_width=True)
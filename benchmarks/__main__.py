@@ -0,0 +1,142 @@
+"""Time and memory-profile each wrangler pipeline stage against the offline fixtures.
+
+Run from the repository root with:
+
+    poetry run python -m benchmarks --scales 1 10 100 --output results.json
+    poetry run python -m benchmarks --output after.json --compare results.json
+"""
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import time
+import timeit
+import tracemalloc
+from pathlib import Path
+
+import polars as pl
+
+from .stages import PIPELINES
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_output_size(output):
+    # Polars allocates outside the Python heap, so the size of the frame a stage returns is recorded alongside tracemalloc
+    if isinstance(output, pl.LazyFrame):
+        output = output.collect()
+    if isinstance(output, pl.DataFrame):
+        return output.height, output.estimated_size()
+    return None, None
+
+
+def get_output_rows(output):
+    if isinstance(output, pl.DataFrame):
+        return output.height
+    return None
+
+
+def measure_stage(function, stage_input, repeat):
+
+    # Warm up first, so libraries imported on first use are not counted against the stage
+    function(stage_input)
+
+    # Timing pass, the best of several runs is the least noisy figure
+    gc.collect()
+    seconds = min(timeit.repeat(lambda: function(stage_input), number=1, repeat=repeat))
+
+    # Memory pass, kept separate because tracemalloc slows down everything it watches
+    gc.collect()
+    tracemalloc.start()
+    output = function(stage_input)
+    _, peak_python_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rows_out, output_bytes = get_output_size(output)
+
+    return output, {
+        "seconds": seconds,
+        "peak_python_bytes": peak_python_bytes,
+        "rows_in": get_output_rows(stage_input),
+        "rows_out": rows_out,
+        "output_bytes": output_bytes,
+    }
+
+
+def run_pipeline(name, scale, repeat):
+
+    load_fixture, stages = PIPELINES[name]()
+
+    fixture = load_fixture(scale)
+    outputs = {None: fixture}
+
+    results = []
+    for stage_name, function, input_stage in stages:
+        outputs[stage_name], measurement = measure_stage(function, outputs[input_stage], repeat)
+        results.append({"pipeline": name, "stage": stage_name, "scale": scale, **measurement})
+        print(
+            f"{name:<28} {stage_name:<44} {scale:>4}x {measurement['seconds'] * 1000:>10.2f} ms "
+            f"{measurement['peak_python_bytes'] / 2 ** 20:>9.2f} MiB {str(measurement['rows_out']):>10} rows"
+        )
+
+    return results
+
+
+def compare(results, baseline):
+
+    # Match stages on pipeline, stage and scale, and report the change in best time
+    baseline_seconds = {
+        (result["pipeline"], result["stage"], result["scale"]): result["seconds"]
+        for result in baseline["results"]
+    }
+
+    print(f"\nCompared with {baseline.get('git_revision')} recorded at {baseline.get('recorded_at')}")
+    for result in results:
+        key = (result["pipeline"], result["stage"], result["scale"])
+        if key not in baseline_seconds:
+            continue
+        ratio = result["seconds"] / baseline_seconds[key]
+        print(f"{result['pipeline']:<28} {result['stage']:<44} {result['scale']:>4}x {ratio:>8.2f}x the baseline time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", nargs="+", choices=list(PIPELINES), default=list(PIPELINES))
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="compare against results previously written with --output")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.pipelines:
+        for scale in args.scales:
+            results.extend(run_pipeline(name, scale, args.repeat))
+
+    report = {
+        "git_revision": get_git_revision(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "results": results,
+    }
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.output}")
+
+    if args.compare is not None:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare the per-row and batched coordinate conversion on the bundled REPD extract.
+
+Run from the repository root with:
+
+    poetry run python benchmarks/benchmark_convert_coordinates.py
+"""
+import timeit
+from pathlib import Path
+
+import polars as pl
+from pyproj import Transformer
+
+from renewable_locations_wrangler import RenewableLocationsWrangler
+
+REPD_CSV = Path(__file__).resolve().parent.parent / "notebooks" / "data.csv"
+
+
+def load_repd_extract(wrangler):
+    # The CSV extract holds the same columns as the REPD sheet of the xlsx, but with everything read as text
+    df = pl.read_csv(REPD_CSV, encoding="utf8-lossy", infer_schema_length=0)
+    return wrangler.prune_and_rename_columns(df).with_columns([
+        pl.col("x_coordinate").cast(pl.Float64, strict=False),
+        pl.col("y_coordinate").cast(pl.Float64, strict=False),
+    ])
+
+
+def convert_coordinates_per_row(df):
+    # The original implementation: one PROJ call per row
+    transformer = Transformer.from_crs("epsg:27700", "epsg:4326")
+
+    def transform_coords(x, y):
+        lat, lon = transformer.transform(x, y)
+        return lat, lon
+
+    coords = df.select(["x_coordinate", "y_coordinate"]).to_numpy()
+    latitudes, longitudes = zip(*[transform_coords(x, y) for x, y in coords])
+
+    return df.with_columns([
+        pl.Series("latitude", latitudes),
+        pl.Series("longitude", longitudes)
+    ])
+
+
+def main(repeat=5):
+    wrangler = RenewableLocationsWrangler()
+    df = load_repd_extract(wrangler).pipe(wrangler.drop_nulls_in_coordinates)
+
+    per_row = min(timeit.repeat(lambda: convert_coordinates_per_row(df), number=1, repeat=repeat))
+    batched = min(timeit.repeat(lambda: wrangler.convert_coordinates(df), number=1, repeat=repeat))
+
+    # Both paths must agree before the timings mean anything
+    expected = convert_coordinates_per_row(df).select(["latitude", "longitude"])
+    actual = wrangler.convert_coordinates(df).select(["latitude", "longitude"])
+    max_difference = (expected - actual).select(pl.all().abs().max()).max_horizontal().item()
+
+    print(f"Rows converted:     {df.height}")
+    print(f"Per-row conversion: {per_row * 1000:.1f} ms")
+    print(f"Batched conversion: {batched * 1000:.1f} ms")
+    print(f"Speed up:           {per_row / batched:.1f}x")
+    print(f"Max difference:     {max_difference:.2e} degrees")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import io
+from pathlib import Path
+
+import arrow
+import polars as pl
+import requests
+
+from historic_generation_wrangler import HistoricGenerationWrangler
+from http_transport import HttpTransport
+from renewable_locations_wrangler import RenewableLocationsWrangler
+from weather_wrangler import WeatherWrangler
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+CASSETTE_DIR = FIXTURES_DIR / "cassettes"
+
+# One day of FUELINST readings and one week of hourly weather at a single point
+FIXTURE_START = arrow.get("2024-01-15")
+STORMGLASS_POINT = (56.0021, -3.78535)
+
+# The key never leaves the request headers, which are not recorded
+STORMGLASS_API_KEY = "offline"
+
+# Spreading the scaled up REPD copies by roughly a kilometre keeps the clustering stage realistic
+REPD_JITTER_METRES = 1000
+
+
+# Each fixture is fetched the same way when it is recorded and when it is replayed, so the request keys match
+
+
+def fetch_fuelinst(transport):
+    hgw = HistoricGenerationWrangler(transport=transport)
+    params = hgw.get_request_params(FIXTURE_START.shift(minutes=5), FIXTURE_START.shift(days=1))
+    return transport.get(hgw.elexon_url, params=params)
+
+
+def fetch_repd(transport):
+    return RenewableLocationsWrangler(transport=transport).fetch_data()
+
+
+def fetch_stormglass(transport):
+    return WeatherWrangler(api_key=STORMGLASS_API_KEY, transport=transport).make_request(
+        *STORMGLASS_POINT, FIXTURE_START, FIXTURE_START.shift(hours=167)
+    )
+
+
+def get_replay_transport():
+    if not CASSETTE_DIR.is_dir():
+        raise FileNotFoundError(f"Cassettes {CASSETTE_DIR} not found, run python -m benchmarks.make_fixtures first")
+    return HttpTransport(mode="replay", cassette_dir=CASSETTE_DIR)
+
+
+def load_fuelinst_payload(scale=1):
+
+    # The recording holds one day of FUELINST readings, each copy is shifted on by another day
+    records = pl.DataFrame(fetch_fuelinst(get_replay_transport()).json())
+    days = records["settlementDate"].n_unique()
+
+    copies = []
+    for copy in range(scale):
+        offset = pl.duration(days=copy * days)
+        copies.append(records.with_columns(
+            [
+                (pl.col(column).str.strptime(pl.Datetime("us"), "%Y-%m-%dT%H:%M:%SZ") + offset).dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+                for column in ["publishTime", "startTime"]
+            ]
+            + [(pl.col("settlementDate").str.strptime(pl.Date, "%Y-%m-%d") + offset).dt.strftime("%Y-%m-%d")]
+        ))
+
+    # Returned as the raw response body, so parsing is part of what gets measured
+    return pl.concat(copies).write_json().encode("utf-8")
+
+
+def replay_response(body):
+    # A response whose body is read from memory, so streamed parsing runs exactly as it would against the API
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def load_repd_data(scale=1):
+
+    # The recorded spreadsheet is parsed as it is at every scale, there is only ever one REPD extract to read
+    content = fetch_repd(get_replay_transport()).content
+    df = RenewableLocationsWrangler().parse_data(content)
+
+    # The later stages work on copies with fresh ref_ids and deterministically jittered coordinates
+    max_ref_id = df["Ref ID"].max()
+    copies = [df]
+    for copy in range(1, scale):
+        jitter = (pl.int_range(pl.len()) * 7919 + copy * 104729) % (2 * REPD_JITTER_METRES) - REPD_JITTER_METRES
+        copies.append(df.with_columns([
+            pl.col("Ref ID") + copy * max_ref_id,
+            pl.col("X-coordinate") + jitter,
+            pl.col("Y-coordinate") - jitter,
+        ]))
+
+    return {"content": content, "data": pl.concat(copies)}
+
+
+def load_stormglass_response(scale=1):
+
+    # The recording is a week of hourly observations for one point, each copy extends the series by another week
+    response = fetch_stormglass(get_replay_transport())
+    hours = pl.DataFrame(response["hours"], infer_schema_length=None)
+    step = pl.duration(hours=hours.height)
+
+    copies = [
+        hours.with_columns(
+            (pl.col("time").str.strptime(pl.Datetime("us"), "%Y-%m-%dT%H:%M:%S+00:00") + step * copy)
+            .dt.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        )
+        for copy in range(scale)
+    ]
+
+    return {"hours": pl.concat(copies).to_dicts(), "meta": response["meta"]}
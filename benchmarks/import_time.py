@@ -0,0 +1,95 @@
+"""Check that the data-only import path meets its import time budget.
+
+Imports the wrangler packages in a fresh interpreter under python -X importtime, reports
+the slowest top-level imports, and fails if the total exceeds the budget or any of the
+plotting, clustering or projection libraries were loaded. Run from the repository root with:
+
+    poetry run python -m benchmarks.import_time --budget-ms 1000
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Everything a CLI job or the app needs to fetch, store and analyse data, without drawing anything
+DATA_PATH_MODULES = [
+    "historic_generation_wrangler",
+    "renewable_locations_wrangler",
+    "weather_wrangler",
+    "wind_analytics",
+    "pipeline_instrumentation",
+    "http_transport",
+]
+
+# Libraries that must only load on first use of a chart, a cluster fit or a coordinate conversion
+DEFERRED_MODULES = ["plotly", "sklearn", "scipy", "pyproj"]
+
+
+def measure_imports(modules):
+
+    # A fresh interpreter each time, so nothing is already in sys.modules
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(SRC_DIR), os.environ.get("PYTHONPATH")]))}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+
+    # Lines look like "import time:   self [us] | cumulative | <indent>package", two spaces of indent per level
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), level, int(own), int(cumulative)))
+
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    # The first run also writes bytecode caches, so the fastest of several runs is what gets checked
+    runs = [measure_imports(DATA_PATH_MODULES) for _ in range(args.repeat)]
+    totals = [
+        sum(cumulative for name, level, _, cumulative in run if level == 0 and name in DATA_PATH_MODULES)
+        for run in runs
+    ]
+    best = runs[totals.index(min(totals))]
+    total_ms = min(totals) / 1000
+
+    print(f"Import time of the data-only path (best of {args.repeat}):")
+    for name, level, _, cumulative in best:
+        if level == 0 and name in DATA_PATH_MODULES:
+            print(f"  {cumulative / 1000:>9.1f} ms  {name}")
+
+    # Self time summed per top-level package shows which dependency the time actually goes on
+    packages = {}
+    for name, _, own, _ in best:
+        packages[name.split(".")[0]] = packages.get(name.split(".")[0], 0) + own
+    print("Slowest packages:")
+    for name, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {own / 1000:>9.1f} ms  {name}")
+    print(f"Total: {total_ms:.1f} ms, budget: {args.budget_ms:.0f} ms")
+
+    loaded = sorted(set(packages) & set(DEFERRED_MODULES))
+    failed = False
+    if loaded:
+        print(f"FAIL: the data-only path imported {', '.join(loaded)}, which should only load on first use")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import took {total_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
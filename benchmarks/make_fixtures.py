@@ -0,0 +1,71 @@
+"""Record the Elexon, gov.uk and Stormglass responses the benchmark suite replays.
+
+A small REPD spreadsheet is cut from the bundled notebooks/data.csv extract, laid out
+and typed like the REPD sheet of the gov.uk xlsx. The StubServer then answers the
+Elexon /stream, gov.uk and Stormglass /v2/weather/point requests with it and with its
+deterministic generated data, and every response is recorded through HttpTransport
+into benchmarks/fixtures/cassettes. Writing the spreadsheet needs the xlsxwriter dev
+dependency. Run from the repository root with:
+
+    poetry run python -m benchmarks.make_fixtures
+"""
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import polars as pl
+import xlsxwriter
+
+from http_transport import HttpTransport, StubServer
+
+from .fixtures import CASSETTE_DIR, FIXTURES_DIR, fetch_fuelinst, fetch_repd, fetch_stormglass
+
+REPD_CSV = Path(__file__).resolve().parent.parent / "notebooks" / "data.csv"
+
+# Every nth site of the extract goes into the REPD spreadsheet, keeping it small enough to commit
+REPD_SAMPLE_EVERY = 10
+
+
+def make_repd_data():
+
+    # The same columns and types the REPD sheet of the gov.uk xlsx reads back with
+    return pl.read_csv(REPD_CSV, encoding="utf8-lossy", infer_schema_length=0).gather_every(REPD_SAMPLE_EVERY).with_columns([
+        pl.col("Ref ID").cast(pl.Int64, strict=False),
+        pl.col("Installed Capacity (MWelec)").cast(pl.Float64, strict=False),
+        pl.col("X-coordinate").cast(pl.Float64, strict=False),
+        pl.col("Y-coordinate").cast(pl.Float64, strict=False),
+        pl.col("Operational").str.strptime(pl.Date, "%d/%m/%Y", strict=False),
+    ])
+
+
+def write_repd_xlsx(path, df):
+
+    # A fixed creation time keeps the spreadsheet byte for byte the same on every run
+    workbook = xlsxwriter.Workbook(path)
+    workbook.set_properties({"created": datetime(2024, 1, 1)})
+    df.write_excel(workbook, worksheet="REPD", autofit=False, dtype_formats={pl.Date: "dd/mm/yyyy"})
+    workbook.close()
+
+
+def main():
+    FIXTURES_DIR.mkdir(exist_ok=True)
+
+    # Recordings from earlier runs are removed, so the cassettes hold exactly what the benchmarks replay
+    shutil.rmtree(CASSETTE_DIR, ignore_errors=True)
+
+    # The spreadsheet is only kept as the recorded gov.uk response body
+    with tempfile.TemporaryDirectory() as directory:
+        repd_path = Path(directory) / "repd.xlsx"
+        write_repd_xlsx(repd_path, make_repd_data())
+
+        with StubServer(repd_path=repd_path) as stub:
+            transport = HttpTransport(mode="record", cassette_dir=CASSETTE_DIR, base_urls=stub.base_urls)
+            for fetch in (fetch_fuelinst, fetch_repd, fetch_stormglass):
+                fetch(transport)
+
+    print(f"Fixtures written to {FIXTURES_DIR}")
+
+
+if __name__ == "__main__":
+    main()
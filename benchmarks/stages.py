@@ -0,0 +1,69 @@
+import json
+
+import polars as pl
+
+from historic_generation_wrangler import HistoricGenerationWrangler
+from renewable_locations_wrangler import RenewableLocationsWrangler
+from weather_wrangler import WeatherWrangler
+
+from .fixtures import load_fuelinst_payload, load_repd_data, load_stormglass_response, replay_response
+
+STORMGLASS_PARAMETERS = ["airTemperature", "pressure", "windSpeed", "windDirection"]
+
+
+def get_generation_stages():
+
+    hgw = HistoricGenerationWrangler()
+
+    # Each stage is (name, function, name of the stage whose output it takes), None means the fixture itself
+    return load_fuelinst_payload, [
+        ("parse_response", lambda payload: hgw.parse_response(replay_response(payload)), None),
+        # The previous approach of building the whole body as Python objects, kept for comparison
+        ("parse_response_json", lambda payload: pl.DataFrame(json.loads(payload)), None),
+        ("map_fuel_type", hgw.map_fuel_type, "parse_response"),
+        ("exclude_interconnectors", hgw.exclude_interconnectors, "map_fuel_type"),
+        ("exclude_pump_storage", hgw.exclude_pump_storage, "exclude_interconnectors"),
+        ("calculate_percentage_of_total_generation", hgw.calculate_percentage_of_total_generation, "exclude_pump_storage"),
+        ("aggregate_by_settlement_date_and_fuel_type", hgw.aggregate_generation_data_by_settlement_date_and_fuel_type, "calculate_percentage_of_total_generation"),
+        # The whole pipeline eagerly, as one lazy plan and on the streaming engine, as get_generation_data runs it
+        ("pipeline_eager", hgw.build_generation_pipeline, "parse_response"),
+        ("pipeline_lazy", lambda df: hgw.build_generation_pipeline(df.lazy()).collect(), "parse_response"),
+        ("pipeline_streaming", lambda df: hgw.build_generation_pipeline(df.lazy()).collect(engine="streaming"), "parse_response"),
+    ]
+
+
+def get_renewable_locations_stages():
+
+    rlw = RenewableLocationsWrangler()
+
+    # parse_data reads the recorded spreadsheet, the stages after it take the copies scaled up from its output
+    return load_repd_data, [
+        ("parse_data", lambda fixture: rlw.parse_data(fixture["content"]), None),
+        ("prune_and_rename_columns", lambda fixture: rlw.prune_and_rename_columns(fixture["data"]), None),
+        ("select_only_operational_sites", rlw.select_only_operational_sites, "prune_and_rename_columns"),
+        ("select_only_wind_sites", rlw.select_only_wind_sites, "select_only_operational_sites"),
+        ("drop_nulls_in_coordinates", rlw.drop_nulls_in_coordinates, "select_only_wind_sites"),
+        ("convert_coordinates", rlw.convert_coordinates, "drop_nulls_in_coordinates"),
+        ("drop_nulls_in_date_operational", rlw.drop_nulls_in_date_operational, "convert_coordinates"),
+        ("fill_na_in_installed_capacity_mw", rlw.fill_na_in_installed_capacity_mw, "drop_nulls_in_date_operational"),
+        # A fresh wrangler each time, otherwise the clusterer fitted by the first run would only be updated
+        ("add_cluster_labels", lambda df: RenewableLocationsWrangler().add_cluster_labels(df), "fill_na_in_installed_capacity_mw"),
+        ("compute_cumulative_installed_capacity", rlw.compute_cumulative_installed_capacity, "add_cluster_labels"),
+    ]
+
+
+def get_weather_stages():
+
+    # The api_key is never used, parsing does not touch the network
+    ww = WeatherWrangler(api_key="offline")
+
+    return load_stormglass_response, [
+        ("parse_stormglass_response", lambda response: ww.parse_stormglass_response(response, STORMGLASS_PARAMETERS), None),
+    ]
+
+
+PIPELINES = {
+    "get_generation_data": get_generation_stages,
+    "get_renewable_locations": get_renewable_locations_stages,
+    "parse_stormglass_response": get_weather_stages,
+}
@@ -1 +1,3 @@
 from .historic_generation_wrangler import HistoricGenerationWrangler # noqa: F401
+from .generation_store import GenerationStore # noqa: F401
+from .generation_rollups import GenerationRollups # noqa: F401
@@ -0,0 +1,233 @@
+import json
+import math
+from pathlib import Path
+
+import polars as pl
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRollups:
+
+    # Each grain is keyed by the start date of its period
+    GRAINS = {'daily': None, 'weekly': '1w', 'monthly': '1mo'}
+
+    KEYS = ['group', 'name']
+
+    METRICS = ['generation', 'percentage_of_total_generation']
+
+    def __init__(self, relative_accuracy=0.01):
+        # Quantiles are approximated with a log-bucketed sketch, every estimate is within relative_accuracy of a true value
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+
+        # Daily state that every grain is built from: exact statistics plus mergeable bucket counts
+        self.daily_statistics = pl.DataFrame()
+        self.daily_sketches = pl.DataFrame()
+
+        self.tables = {grain: pl.DataFrame() for grain in self.GRAINS}
+
+    def period_start(self, grain):
+        if self.GRAINS[grain] is None:
+            return pl.col('settlementDate')
+        return pl.col('settlementDate').dt.truncate(self.GRAINS[grain])
+
+    def build_daily_statistics(self, generation_data):
+        return generation_data.group_by(['settlementDate'] + self.KEYS).agg(
+            [pl.col(metric).min().alias(f'min_{metric}') for metric in self.METRICS]
+            + [pl.col(metric).max().alias(f'max_{metric}') for metric in self.METRICS]
+            + [pl.len().alias('row_count')]
+        )
+
+    def build_daily_sketches(self, generation_data):
+
+        # Bucket i holds values in (gamma^(i-1), gamma^i], negative values mirror this and zero has its own bucket
+        log_gamma = math.log(self.gamma)
+        sketches = [
+            generation_data
+            .filter(pl.col(metric).is_finite())
+            .select(
+                pl.col('settlementDate'),
+                *self.KEYS,
+                pl.lit(metric).alias('metric'),
+                pl.col(metric).sign().cast(pl.Int8).alias('sign'),
+                pl.when(pl.col(metric) == 0)
+                .then(0)
+                .otherwise((pl.col(metric).abs().log() / log_gamma).ceil())
+                .cast(pl.Int32)
+                .alias('bucket'),
+            )
+            for metric in self.METRICS
+        ]
+
+        return (
+            pl.concat(sketches)
+            .group_by(['settlementDate'] + self.KEYS + ['metric', 'sign', 'bucket'])
+            .agg(pl.len().cast(pl.UInt32).alias('count'))
+        )
+
+    def update(self, generation_data):
+
+        # Batches are merged into the existing state, so each FUELINST reading must only be passed in once
+        if generation_data.is_empty():
+            return self
+
+        daily_statistics = self.build_daily_statistics(generation_data)
+        daily_sketches = self.build_daily_sketches(generation_data)
+
+        if not self.daily_statistics.is_empty():
+            daily_statistics = (
+                pl.concat([self.daily_statistics, daily_statistics], how='vertical_relaxed')
+                .group_by(['settlementDate'] + self.KEYS)
+                .agg(
+                    [pl.col(f'min_{metric}').min() for metric in self.METRICS]
+                    + [pl.col(f'max_{metric}').max() for metric in self.METRICS]
+                    + [pl.col('row_count').sum()]
+                )
+            )
+            daily_sketches = (
+                pl.concat([self.daily_sketches, daily_sketches], how='vertical_relaxed')
+                .group_by(['settlementDate'] + self.KEYS + ['metric', 'sign', 'bucket'])
+                .agg(pl.col('count').sum())
+            )
+
+        self.daily_statistics = daily_statistics.sort(['settlementDate'] + self.KEYS)
+        self.daily_sketches = daily_sketches
+
+        # Only the periods that contain one of the new settlement dates need to be rebuilt
+        settlement_dates = generation_data.select(pl.col('settlementDate').unique())
+        for grain in self.GRAINS:
+            self.materialise(grain, settlement_dates.select(self.period_start(grain).alias('period')).unique())
+
+        logger.info(f"Updated generation rollups for {settlement_dates.height} settlement dates")
+
+        return self
+
+    def materialise(self, grain, periods):
+
+        period_filter = self.period_start(grain).is_in(periods['period'].implode())
+
+        statistics = (
+            self.daily_statistics
+            .filter(period_filter)
+            .group_by(self.period_start(grain).alias('settlementDate'), *self.KEYS)
+            .agg(
+                [pl.col(f'min_{metric}').min() for metric in self.METRICS]
+                + [pl.col(f'max_{metric}').max() for metric in self.METRICS]
+                + [pl.col('row_count').sum()]
+            )
+        )
+
+        medians = self.compute_quantiles(self.daily_sketches.filter(period_filter), grain, 0.5, prefix='median')
+
+        # A bucket's representative value can lie just outside the exact range of the values in it, so keep it inside
+        rollup = statistics.join(medians, on=['settlementDate'] + self.KEYS, how='left').with_columns(
+            [
+                pl.col(f'median_{metric}').clip(pl.col(f'min_{metric}'), pl.col(f'max_{metric}'))
+                for metric in self.METRICS
+            ]
+        ).select(
+            'settlementDate',
+            *self.KEYS,
+            'max_generation',
+            'median_generation',
+            'min_generation',
+            'min_percentage_of_total_generation',
+            'max_percentage_of_total_generation',
+            'median_percentage_of_total_generation',
+            'row_count',
+        )
+
+        # Replace the rebuilt periods and keep everything else as it was
+        existing = self.tables[grain]
+        if not existing.is_empty():
+            existing = existing.filter(~pl.col('settlementDate').is_in(periods['period'].implode()))
+            rollup = pl.concat([existing, rollup], how='vertical_relaxed')
+
+        self.tables[grain] = rollup.sort(['settlementDate'] + self.KEYS)
+
+    def compute_quantiles(self, sketches, grain, quantile, prefix=None):
+
+        keys = ['settlementDate'] + self.KEYS + ['metric']
+
+        # Representative value of a bucket, chosen so the relative error is at most relative_accuracy
+        value = pl.col('sign').cast(pl.Float64) * 2 * pl.lit(self.gamma).pow(pl.col('bucket')) / (self.gamma + 1)
+
+        quantiles = (
+            sketches
+            .with_columns(self.period_start(grain).alias('settlementDate'))
+            .group_by(keys + ['sign', 'bucket'])
+            .agg(pl.col('count').sum())
+            .with_columns(value.alias('value'))
+            .sort(keys + ['value'])
+            .with_columns(
+                pl.col('count').cum_sum().over(keys).alias('cumulative_count'),
+                pl.col('count').sum().over(keys).alias('total_count'),
+            )
+            # The quantile is the first bucket whose cumulative count passes its rank
+            .filter(pl.col('cumulative_count') > quantile * (pl.col('total_count') - 1))
+            .group_by(keys, maintain_order=True)
+            .agg(pl.col('value').first())
+        )
+
+        if prefix is None:
+            prefix = f'p{round(quantile * 100)}'
+
+        quantiles = quantiles.pivot(on='metric', index=['settlementDate'] + self.KEYS, values='value')
+
+        # A metric with no finite values in any period has no column after the pivot, so add it as nulls
+        return quantiles.with_columns(
+            [pl.lit(None, dtype=pl.Float64).alias(metric) for metric in self.METRICS if metric not in quantiles.columns]
+        ).rename({metric: f'{prefix}_{metric}' for metric in self.METRICS})
+
+    def get_rollup(self, grain='daily'):
+        if grain not in self.GRAINS:
+            raise ValueError(f"grain must be one of {list(self.GRAINS)}, got {grain}")
+        return self.tables[grain]
+
+    def get_quantiles(self, grain='daily', quantiles=(0.1, 0.5, 0.9)):
+        if grain not in self.GRAINS:
+            raise ValueError(f"grain must be one of {list(self.GRAINS)}, got {grain}")
+
+        frames = [self.compute_quantiles(self.daily_sketches, grain, quantile) for quantile in quantiles]
+
+        result = frames[0]
+        for frame in frames[1:]:
+            result = result.join(frame, on=['settlementDate'] + self.KEYS, how='full', coalesce=True)
+        return result.sort(['settlementDate'] + self.KEYS)
+
+    def count_periods_below(self, column, threshold, name='Wind', grain='daily'):
+        # For example the number of days where wind never exceeded a given share of total generation
+        return self.get_rollup(grain).filter(
+            (pl.col('name') == name) & (pl.col(column) < threshold)
+        ).height
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        with open(path / 'rollups.json', 'w') as file:
+            json.dump({'relative_accuracy': self.relative_accuracy}, file, indent=2)
+
+        self.daily_statistics.write_parquet(path / 'daily_statistics.parquet')
+        self.daily_sketches.write_parquet(path / 'daily_sketches.parquet')
+        for grain, table in self.tables.items():
+            table.write_parquet(path / f'{grain}.parquet')
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        if not (path / 'rollups.json').is_file():
+            raise FileNotFoundError(f"No saved rollups found at {path}")
+
+        with open(path / 'rollups.json', 'r') as file:
+            settings = json.load(file)
+
+        rollups = cls(relative_accuracy=settings['relative_accuracy'])
+        rollups.daily_statistics = pl.read_parquet(path / 'daily_statistics.parquet')
+        rollups.daily_sketches = pl.read_parquet(path / 'daily_sketches.parquet')
+        rollups.tables = {grain: pl.read_parquet(path / f'{grain}.parquet') for grain in cls.GRAINS}
+
+        return rollups
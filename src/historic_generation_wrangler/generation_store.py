@@ -0,0 +1,211 @@
+import arrow
+import polars as pl
+from deltalake import DeltaTable
+
+import logging
+
+from .historic_generation_wrangler import HistoricGenerationWrangler
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationStore:
+
+    PARTITION_COLUMN = 'settlementDate'
+
+    # Columns that identify a single FUELINST reading
+    MERGE_KEYS = ['publishTime', 'startTime', 'fuelType']
+
+    def __init__(self, store_path, wrangler=None, storage_options=None):
+        # The generation data and the per-partition high-water marks are kept as two Delta tables under store_path
+        self.store_path = str(store_path).rstrip('/')
+        self.generation_table_path = f'{self.store_path}/generation'
+        self.high_water_marks_table_path = f'{self.store_path}/high_water_marks'
+        self.storage_options = storage_options
+
+        if wrangler is None:
+            self.wrangler = HistoricGenerationWrangler()
+        else:
+            self.wrangler = wrangler
+
+    def table_exists(self, table_path):
+        return DeltaTable.is_deltatable(table_path, storage_options=self.storage_options)
+
+    def scan_generation_data(self):
+        # Read the stored generation data lazily so that filters on settlementDate prune partitions
+        if not self.table_exists(self.generation_table_path):
+            raise FileNotFoundError(f"No generation data has been stored at {self.generation_table_path}")
+        return pl.scan_delta(self.generation_table_path, storage_options=self.storage_options) \
+            .pipe(self.wrangler.cast_to_generation_schema)
+
+    def read_generation_data(self, start_date=None, end_date=None):
+        generation_data = self.scan_generation_data()
+
+        if start_date is not None:
+            generation_data = generation_data.filter(pl.col(self.PARTITION_COLUMN) >= start_date)
+        if end_date is not None:
+            generation_data = generation_data.filter(pl.col(self.PARTITION_COLUMN) <= end_date)
+
+        return generation_data.collect()
+
+    def get_high_water_marks(self):
+        # One row per settlementDate partition holding the latest publishTime ingested into it
+        if not self.table_exists(self.high_water_marks_table_path):
+            return pl.DataFrame()
+        return pl.read_delta(self.high_water_marks_table_path, storage_options=self.storage_options)
+
+    def get_high_water_mark(self):
+        high_water_marks = self.get_high_water_marks()
+        if high_water_marks.is_empty():
+            return None
+        return high_water_marks['publishTime'].max()
+
+    def get_missing_windows(self, high_water_marks, start_date, end_date):
+
+        # Settlement dates from start_date up to the latest stored partition that have no high-water mark of their own
+        stored_dates = set(high_water_marks[self.PARTITION_COLUMN].to_list())
+        last_stored_date = max(stored_dates)
+        missing_dates = [
+            day.date() for day in arrow.Arrow.range('day', start_date.floor('day'), arrow.get(last_stored_date))
+            if day.date() not in stored_dates
+        ]
+
+        # Each run of missing dates becomes one window, widened by a day either side because a settlement date is a
+        # UK local date and its readings can be published on the UTC day before or after it
+        windows = []
+        for day in missing_dates:
+            window_start = max(self.get_first_publish_time(start_date), arrow.get(day).shift(days=-1))
+            window_end = min(end_date, arrow.get(day).shift(days=2))
+            if windows and window_start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], window_end)
+            else:
+                windows.append((window_start, window_end))
+
+        return windows
+
+    def get_first_publish_time(self, start_date):
+        # The first readings of a settlement date can be published on the UTC day before it
+        return start_date.floor('day').shift(days=-1)
+
+    def update(self, end_date=None, start_date=None, window_days=None):
+
+        if end_date is None:
+            end_date = arrow.utcnow()
+
+        high_water_marks = self.get_high_water_marks()
+
+        # An empty store is filled from start_date, otherwise the latest partition resumes from its own mark and any
+        # partitions missing between start_date and it are backfilled
+        if high_water_marks.is_empty():
+            if start_date is None:
+                raise ValueError("start_date must be provided when the store is empty")
+            windows = [(self.get_first_publish_time(start_date), end_date)]
+        else:
+            windows = [(arrow.get(high_water_marks['publishTime'].max()), end_date)]
+            if start_date is not None:
+                backfill_windows = self.get_missing_windows(high_water_marks, start_date, end_date)
+                if backfill_windows:
+                    logger.info(f"Backfilling {len(backfill_windows)} gaps in the generation store from {start_date}")
+                windows = backfill_windows + windows
+
+        windows = [(window_start, window_end) for window_start, window_end in windows if window_start < window_end]
+        if not windows:
+            logger.info(f"Generation store is up to date at {end_date}")
+            return pl.DataFrame()
+
+        frames = []
+        for window_start, window_end in windows:
+            logger.info(f"Updating generation store from {window_start} to {window_end}")
+            frames.append(self.wrangler.get_generation_data(window_start, window_end, window_days=window_days))
+
+        new_generation_data = pl.concat(frames, how='vertical_relaxed').unique(
+            subset=self.MERGE_KEYS, keep='first', maintain_order=True
+        )
+
+        # Only whole settlement dates are stored, a partition before start_date would only hold its last readings and
+        # its high-water mark would stop it ever being backfilled
+        if start_date is not None:
+            new_generation_data = new_generation_data.filter(pl.col(self.PARTITION_COLUMN) >= start_date.date())
+
+        if new_generation_data.is_empty():
+            return new_generation_data
+
+        self.write_generation_data(new_generation_data)
+        self.write_high_water_marks(new_generation_data)
+
+        # Return only readings newer than the mark of their own partition, so the result can feed incremental consumers
+        # such as GenerationRollups without passing a reading in twice
+        if not high_water_marks.is_empty():
+            new_generation_data = (
+                new_generation_data
+                .join(
+                    high_water_marks.select(
+                        pl.col(self.PARTITION_COLUMN).cast(new_generation_data.schema[self.PARTITION_COLUMN]),
+                        pl.col('publishTime').alias('high_water_mark'),
+                    ),
+                    on=self.PARTITION_COLUMN,
+                    how='left',
+                )
+                .filter(pl.col('high_water_mark').is_null() | (pl.col('publishTime') > pl.col('high_water_mark')))
+                .drop('high_water_mark')
+            )
+
+        return new_generation_data
+
+    def to_delta_types(self, generation_data):
+        # Delta cannot store dictionary encoded columns, so enums and categoricals are written as plain strings
+        return generation_data.with_columns(pl.col(pl.Categorical, pl.Enum).cast(pl.String))
+
+    def write_generation_data(self, generation_data):
+
+        generation_data = self.to_delta_types(generation_data)
+
+        if not self.table_exists(self.generation_table_path):
+            generation_data.write_delta(
+                self.generation_table_path,
+                mode='append',
+                storage_options=self.storage_options,
+                delta_write_options={'partition_by': [self.PARTITION_COLUMN]},
+            )
+            return
+
+        # The window starting at the high-water mark overlaps the last ingested readings, so merge rather than append.
+        # Matching on the partition column as well lets Delta skip the partitions that are not being touched.
+        predicate = ' AND '.join(
+            f'target.{column} = source.{column}' for column in [self.PARTITION_COLUMN] + self.MERGE_KEYS
+        )
+        (
+            generation_data.write_delta(
+                self.generation_table_path,
+                mode='merge',
+                storage_options=self.storage_options,
+                delta_merge_options={
+                    'predicate': predicate,
+                    'source_alias': 'source',
+                    'target_alias': 'target',
+                },
+            )
+            .when_matched_update_all()
+            .when_not_matched_insert_all()
+            .execute()
+        )
+
+    def write_high_water_marks(self, generation_data):
+
+        new_high_water_marks = generation_data.group_by(self.PARTITION_COLUMN).agg(
+            pl.col('publishTime').max()
+        )
+
+        # Combine with the existing marks, keeping the latest publishTime for every partition
+        high_water_marks = (
+            pl.concat([self.get_high_water_marks(), new_high_water_marks], how='diagonal_relaxed')
+            .group_by(self.PARTITION_COLUMN)
+            .agg(pl.col('publishTime').max())
+            .sort(self.PARTITION_COLUMN)
+        )
+
+        high_water_marks.write_delta(
+            self.high_water_marks_table_path,
+            mode='overwrite',
+            storage_options=self.storage_options,
+        )
@@ -1,13 +1,18 @@
 import requests
 import arrow
+import io
 
-import plotly.express as px
-import plotly.graph_objects as go
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
 
 import polars as pl
 
 import logging
-logging.basicConfig(level=logging.INFO)
+
+from pipeline_instrumentation import PipelineInstrumentation
+from http_transport import HttpTransport
+
+logger = logging.getLogger(__name__)
 
 class HistoricGenerationWrangler:
     
@@ -36,41 +41,301 @@ class HistoricGenerationWrangler:
         ]
     )
     
-    def __init__(self, elexon_url=None):
+    # Enum dictionaries derived from fuel_type_mapping, so fuel types, groups and names are stored as small integer codes
+    fuel_type_enum = pl.Enum(fuel_type_mapping['fuelType'].to_list())
+    group_enum = pl.Enum(fuel_type_mapping['group'].unique(maintain_order=True).to_list())
+    name_enum = pl.Enum(fuel_type_mapping['name'].to_list())
+    fuel_type_groups = dict(zip(fuel_type_mapping['fuelType'].to_list(), fuel_type_mapping['group'].to_list()))
+    fuel_type_names = dict(zip(fuel_type_mapping['fuelType'].to_list(), fuel_type_mapping['name'].to_list()))
+    
+    # Column types of a FUELINST record as it arrives, declared up front so each streamed batch decodes straight into typed columns
+    fuelinst_schema = {
+        'dataset': pl.String,
+        'publishTime': pl.String,
+        'startTime': pl.String,
+        'settlementDate': pl.String,
+        'settlementPeriod': pl.Int8,
+        'fuelType': pl.String,
+        'generation': pl.Int32,
+    }
+    
+    # Canonical compact schema of generation frames, times are parsed once at ingest and kept in UTC
+    generation_schema = {
+        'dataset': pl.Categorical,
+        'publishTime': pl.Datetime('us', 'UTC'),
+        'startTime': pl.Datetime('us', 'UTC'),
+        'settlementDate': pl.Date,
+        'settlementPeriod': pl.Int8,
+        'fuelType': fuel_type_enum,
+        'generation': pl.Int32,
+        'group': group_enum,
+        'name': name_enum,
+        'total_generation': pl.Int32,
+        'percentage_of_total_generation': pl.Float64,
+    }
+    
+    # Plot colour for every name in fuel_type_mapping, shared by all of the plotting methods
+    fuel_colors = {
+        'Nuclear': '#808080',  # grey
+        'Hydro': '#0000FF',  # blue
+        'Pumped Storage': '#ADD8E6',  # light blue
+        'Biomass': '#FFA500',  # orange
+        'Other': '#FFFF00',  # yellow
+        'OCGT': '#FFC0CB',  # pink
+        'Coal': '#FFA07A',  # light red
+        'Oil': '#8B0000',  # dark red
+        'CCGT': '#FF0000',  # red
+        'Wind': '#008000',  # green
+        'greenlink': '#4B0082',  # interconnectors in shades of purple
+        'ewic': '#6A0DAD',
+        'eleclink': '#800080',
+        'nsl': '#8A2BE2',
+        'ifa2': '#9370DB',
+        'nemo': '#9932CC',
+        'moyle': '#BA55D3',
+        'viking': '#DA70D6',
+        'britned': '#DDA0DD',
+        'france': '#EE82EE',
+    }
+    
+    # Stacking order for generation plots, from baseload at the bottom to wind at the top
+    fuel_order = [
+        'Nuclear',
+        'Hydro', 'Pumped Storage',
+        'Biomass', 'Other',
+        'OCGT', 'Coal', 'Oil', 'CCGT',
+        'Wind'
+    ]
+    
+    # Line style and width for each statistic produced by aggregate_generation_data_by_settlement_date_and_fuel_type
+    statistic_line_styles = {
+        'max_generation': ('solid', 4),
+        'median_generation': ('dash', 2),
+        'min_generation': ('solid', 1),
+        'max_percentage_of_total_generation': ('solid', 4),
+        'median_percentage_of_total_generation': ('dash', 2),
+        'min_percentage_of_total_generation': ('solid', 1),
+    }
+    
+    ELEXON_URL = 'https://data.elexon.co.uk/bmrs/api/v1/datasets/FUELINST/stream'
+    
+    def __init__(self, elexon_url=None, max_workers=8, max_retries=3, timeout=60, instrumentation=None, stream_chunk_size=4 * 2 ** 20, transport=None):
         if elexon_url is None:
-            self.elexon_url = 'https://data.elexon.co.uk/bmrs/api/v1/datasets/FUELINST/stream'
+            self.elexon_url = self.ELEXON_URL
         else:
-            self.elexon_url = url
+            self.elexon_url = elexon_url
+        
+        # Settings used by the windowed backfill in download_data_in_windows
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        
+        # Every request goes through the transport, which can be shared between wranglers and set to record or replay
+        if transport is None:
+            transport = HttpTransport(pool_size=max_workers)
+        self.transport = transport
+        
+        # Bytes of response body read and decoded at a time, which bounds the raw JSON held in memory
+        self.stream_chunk_size = stream_chunk_size
+        
+        # Opt-in per stage timing, a disabled instance leaves every stage unwrapped
+        if instrumentation is None:
+            instrumentation = PipelineInstrumentation(enabled=False)
+        self.instrumentation = instrumentation
     
-    def get_generation_data(self, start_date, end_date):
+    def get_generation_data(self, start_date, end_date, window_days=None, lazy=False, streaming=False):
         
         # Check start_date and end_date are valid arrow dates
         if not isinstance(start_date, arrow.Arrow) or not isinstance(end_date, arrow.Arrow):
             raise ValueError("start_date and end_date must be arrow.Arrow objects")
         
+        with self.instrumentation.span('get_generation_data'):
+            
+            # Long ranges are split into windows and fetched concurrently, short ranges use a single request
+            if window_days is None:
+                generation_data = self.instrumentation.stage(self.download_data)(start_date, end_date)
+            else:
+                generation_data = self.instrumentation.stage(self.download_data_in_windows)(start_date, end_date, window_days)
+            
+            # In lazy mode the same stages are combined into a single optimised query plan before anything is materialised
+            if lazy:
+                return self.instrumentation.stage(self.collect_generation_pipeline)(
+                    self.build_generation_pipeline(generation_data.lazy()), streaming
+                )
+            
+            return self.build_generation_pipeline(generation_data)
+    
+    def build_generation_pipeline(self, generation_data):
+        
+        # Frames from the API are already in the canonical schema, so the first stage only has work to do for other sources
+        # Interconnectors and pumped storage are excluded before the window sum so they do not count towards total generation
+        stage = self.instrumentation.stage
         return (
-            self.download_data(start_date, end_date) \
-            .pipe(self.join_fuel_type, self.fuel_type_mapping) \
-            .pipe(self.calculate_percentage_of_total_generation) \
-            .pipe(self.convert_settlement_date_to_date) \
-            .pipe(self.exclude_interconnectors)
-            .pipe(self.exclude_pump_storage)
+            generation_data \
+            .pipe(stage(self.cast_to_generation_schema)) \
+            .pipe(stage(self.map_fuel_type)) \
+            .pipe(stage(self.exclude_interconnectors)) \
+            .pipe(stage(self.exclude_pump_storage)) \
+            .pipe(stage(self.calculate_percentage_of_total_generation))
         )
     
+    def collect_generation_pipeline(self, generation_pipeline, streaming=False):
+        return generation_pipeline.collect(engine='streaming' if streaming else 'auto')
+    
     def download_data(self, start_date, end_date):
         # Assuming start_date and end_date are arrow objects
-        publish_date_time_from = start_date.format('YYYY-MM-DDTHH:mm:ss') + 'Z'
-        publish_date_time_to = end_date.format('YYYY-MM-DDTHH:mm:ss') + 'Z'
-        request_url = f'{self.elexon_url}?publishDateTimeFrom={publish_date_time_from}&publishDateTimeTo={publish_date_time_to}'
-        logging.info(f"Downloading data from {request_url}")
-        response = requests.get(request_url)
+        params = self.get_request_params(start_date, end_date)
+        logger.info(f"Downloading data from {self.elexon_url} with {params}")
+        with self.instrumentation.span('request', url=self.elexon_url, **params):
+            response = self.transport.get(self.elexon_url, params=params, timeout=self.timeout, stream=True)
 
         if response.status_code != 200:
             raise Exception(f"Failed to download data: {response.status_code} - {response.text}")
-        return pl.DataFrame(response.json())
+        return self.instrumentation.stage(self.parse_response)(response)
+
+    def parse_response(self, response):
+        
+        # Decode the body a batch at a time rather than building the whole response as Python objects
+        try:
+            batches = [self.parse_record_batch(segment) for segment in self.iter_record_segments(response)]
+        finally:
+            response.close()
+        
+        if not batches:
+            return self.parse_record_batch(b'')
+        return pl.concat(batches, rechunk=True)
+    
+    def iter_record_segments(self, response):
+        
+        # FUELINST records are flat objects, so every closing brace ends a record and the buffer can be cut after the last one
+        buffer = b''
+        for chunk in response.iter_content(chunk_size=self.stream_chunk_size):
+            buffer += chunk
+            end = buffer.rfind(b'}')
+            if end == -1:
+                continue
+            yield buffer[:end + 1]
+            buffer = buffer[end + 1:]
+        
+        # Only the closing bracket of the array should be left over
+        if buffer.strip(b' \t\r\n[],'):
+            raise ValueError(f"Unexpected content at the end of the FUELINST response: {buffer[:100]!r}")
+    
+    def parse_record_batch(self, segment):
+        # A segment is a run of complete records, led by the array's opening bracket or the comma before the next record
+        segment = segment.lstrip(b' \t\r\n[,')
+        if segment:
+            batch = pl.read_json(io.BytesIO(b'[' + segment + b']'), schema=self.fuelinst_schema)
+        else:
+            batch = pl.DataFrame(schema=self.fuelinst_schema)
+        
+        # Elexon occasionally adds fuel types, which have no group or name until they are added to fuel_type_mapping
+        unknown_fuel_types = batch.filter(~pl.col('fuelType').is_in(self.fuel_type_enum.categories.implode()))['fuelType'].unique()
+        if unknown_fuel_types.len() > 0:
+            logger.warning(f"Dropping readings for fuel types missing from fuel_type_mapping: {unknown_fuel_types.to_list()}")
+        
+        return self.cast_to_generation_schema(batch)
+    
+    def cast_to_generation_schema(self, generation_data):
+        
+        schema = generation_data.collect_schema()
+        
+        # Readings for unknown fuel types are dropped, as the inner join against fuel_type_mapping used to
+        if schema['fuelType'] != self.fuel_type_enum:
+            generation_data = generation_data.filter(pl.col('fuelType').cast(pl.String).is_in(self.fuel_type_enum.categories.implode()))
+        
+        # Text columns are parsed, everything else is cast, which costs nothing when the type already matches
+        columns = []
+        for column, dtype in self.generation_schema.items():
+            if column not in schema:
+                continue
+            if schema[column] == pl.String and dtype == pl.Date:
+                columns.append(pl.col(column).str.strptime(pl.Date, '%Y-%m-%d'))
+            elif schema[column] == pl.String and isinstance(dtype, pl.Datetime):
+                columns.append(pl.col(column).str.strptime(dtype, '%Y-%m-%dT%H:%M:%SZ'))
+            elif isinstance(schema[column], pl.Datetime) and schema[column].time_zone is None:
+                columns.append(pl.col(column).cast(pl.Datetime('us')).dt.replace_time_zone('UTC'))
+            else:
+                columns.append(pl.col(column).cast(dtype))
+        
+        return generation_data.with_columns(columns)
+
+    def get_request_params(self, start_date, end_date):
+        return {
+            'publishDateTimeFrom': start_date.format('YYYY-MM-DDTHH:mm:ss') + 'Z',
+            'publishDateTimeTo': end_date.format('YYYY-MM-DDTHH:mm:ss') + 'Z',
+        }
+
+    def split_into_windows(self, start_date, end_date, window_days):
+        # Split [start_date, end_date) into consecutive windows of at most window_days
+        if window_days <= 0:
+            raise ValueError("window_days must be greater than zero")
+        
+        windows = []
+        window_start = start_date
+        while window_start < end_date:
+            window_end = min(window_start.shift(days=window_days), end_date)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        return windows
+
+    def download_window(self, window_start, window_end):
+        params = self.get_request_params(window_start, window_end)
+        publish_date_time_from = params['publishDateTimeFrom']
+        publish_date_time_to = params['publishDateTimeTo']
+        
+        # Retry each window on its own, backing off exponentially between attempts
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.transport.get(self.elexon_url, params=params, timeout=self.timeout, stream=True)
+                if response.status_code == 200:
+                    return self.instrumentation.stage(self.parse_response)(response)
+                error = f"{response.status_code} - {response.text}"
+            except requests.RequestException as exception:
+                error = str(exception)
+            
+            logger.warning(f"Window {publish_date_time_from} to {publish_date_time_to} failed (attempt {attempt + 1}): {error}")
+            if attempt < self.max_retries:
+                time.sleep(2 ** attempt)
+        
+        raise Exception(f"Failed to download data for window {publish_date_time_from} to {publish_date_time_to}: {error}")
 
-    def join_fuel_type(self, generation_data, fuel_type_mapping):
-        return generation_data.join(fuel_type_mapping, on='fuelType')
+    def download_data_in_windows(self, start_date, end_date, window_days=7):
+        windows = self.split_into_windows(start_date, end_date, window_days)
+        logger.info(f"Downloading {len(windows)} windows of {window_days} days from {self.elexon_url} using {self.max_workers} workers")
+        
+        # Fetch the windows concurrently, keeping each result against its window index so the output stays in time order
+        frames = [None] * len(windows)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.instrumentation.stage(self.download_window), window_start, window_end): index
+                for index, (window_start, window_end) in enumerate(windows)
+            }
+            try:
+                for future in as_completed(futures):
+                    frames[futures[future]] = future.result()
+            except Exception:
+                # A window that ran out of retries fails the whole download, so the queued windows are not fetched
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        
+        frames = [frame for frame in frames if frame.height > 0]
+        if not frames:
+            return self.parse_record_batch(b'')
+        
+        # Adjacent windows share their boundary timestamp, so drop the duplicated rows
+        return pl.concat(frames, how='vertical_relaxed').unique(
+            subset=['publishTime', 'startTime', 'fuelType'], keep='first', maintain_order=True
+        )
+
+    def map_fuel_type(self, generation_data):
+        # fuel_type_mapping is applied as an enum dictionary lookup on the fuelType codes, rather than a join
+        return generation_data.with_columns(
+            [
+                pl.col('fuelType').replace_strict(self.fuel_type_groups, return_dtype=self.group_enum).alias('group'),
+                pl.col('fuelType').replace_strict(self.fuel_type_names, return_dtype=self.name_enum).alias('name'),
+            ]
+        )
     
     def calculate_percentage_of_total_generation(self, generation_data):
         # Apply a window function to calculate the total generation for each group of startTime, settlementDate, settlementPeriod, group and name
@@ -90,65 +355,56 @@ class HistoricGenerationWrangler:
     
         return generation_data
     
-    def convert_settlement_date_to_date(self, generation_data):
-        return generation_data.with_columns(
-            [
-                pl.col('settlementDate').str.strptime(pl.Date, "%Y-%m-%d")
-            ]
-        )
-    
     def exclude_interconnectors(self, generation_data):
         return generation_data.filter(pl.col('group') != 'Interconnector')
 
     def exclude_pump_storage(self, generation_data):
         return generation_data.filter(pl.col('name') != 'Pumped Storage')
     
-    def plot_generation_data(self, generation_data):
+    def plot_generation_data(self, generation_data, max_points=2000, render_mode='webgl'):
         
-        # Convert startTime to datetime
-        generation_data = generation_data.with_columns(
-            [
-                pl.col("startTime").str.strptime(pl.Datetime, "%Y-%m-%dT%H:%M:%SZ")
-            ]
-        )
-
-        # Create the plot
-        # Define the color sequence and category order
-        
-        color_sequence = [
-            '#808080',  # grey (Nuclear)
-            '#0000FF',  # blue (Hydro)
-            '#ADD8E6',  # light blue (Pumped Storage)
-            '#FFA500',  # orange (Biomass)
-            '#FFFF00',  # yellow (Other)
-            '#FFC0CB',  # pink (OCGT)
-            '#FFA07A',  # light red (Coal)
-            '#8B0000',  # dark red (Oil)
-            '#FF0000',  # red (CCGT)
-            '#008000'   # green (Wind)
-        ]
-
-        category_order = [
-            'Nuclear',
-            'Hydro', 'Pumped Storage',
-            'Biomass', 'Other',
-            'OCGT', 'Coal', 'Oil', 'CCGT',
-            'Wind'
-        ]
-
-        fig = px.area(
-            generation_data,
-            x='startTime',
-            y='generation',
-            color='name',
-            title='Generation Data by Fuel Type',
-            line_group='group',
-            groupnorm='fraction',
-            category_orders={'name': category_order},
-            color_discrete_sequence=color_sequence
-        )
+        # Plotly is only imported when a chart is drawn, so data-only jobs never pay for it
+        import plotly.graph_objects as go
+        
+        # Only parse startTime if it has not already been converted to a datetime
+        if generation_data.schema['startTime'] == pl.String:
+            generation_data = generation_data.with_columns(
+                [
+                    pl.col("startTime").str.strptime(pl.Datetime, "%Y-%m-%dT%H:%M:%SZ")
+                ]
+            )
+        
+        # Reduce to at most max_points time buckets before building the figure, so payload size does not grow with the range
+        generation_data = self.downsample_generation_data(generation_data, max_points)
+        
+        # Stack the fractions of total generation ourselves, which gives the same chart as groupnorm='fraction' but works with WebGL traces
+        names = [name for name in self.fuel_order if name in generation_data.columns] \
+            + [name for name in generation_data.columns if name not in self.fuel_order and name != 'startTime']
+        totals = generation_data.select(pl.sum_horizontal(names)).to_series()
+        fractions = generation_data.select([(pl.col(name) / totals).fill_nan(0).alias(name) for name in names])
+        stacked = fractions.select([pl.sum_horizontal(names[:index + 1]).alias(name) for index, name in enumerate(names)])
+        
+        scatter = go.Scattergl if render_mode == 'webgl' else go.Scatter
+        
+        fig = go.Figure()
+        
+        for index, name in enumerate(names):
+            fig.add_trace(scatter(
+                x=generation_data['startTime'],
+                y=stacked[name],
+                customdata=fractions[name],
+                mode='lines',
+                name=name,
+                fill='tozeroy' if index == 0 else 'tonexty',
+                line=dict(width=0.5, color=self.fuel_colors.get(name)),
+                hovertemplate='%{customdata:.1%}',
+            ))
         
         fig.update_layout(
+            title='Generation Data by Fuel Type',
+            xaxis_title='startTime',
+            yaxis_title='generation',
+            legend_title='name',
             autosize=True,
             width=1200,
             height=800
@@ -156,6 +412,27 @@ class HistoricGenerationWrangler:
         
         return fig
     
+    def downsample_generation_data(self, generation_data, max_points=2000):
+        
+        # With no readings there is nothing to bucket, so return the usual columns with no rows and the chart is drawn empty
+        if generation_data.is_empty():
+            return pl.DataFrame(schema={'startTime': generation_data.schema['startTime'], **{name: pl.Float64 for name in self.fuel_order}})
+        
+        # Choose a bucket width that is a whole number of 5 minute readings and gives at most max_points buckets
+        time_range = generation_data.select(pl.col('startTime').max() - pl.col('startTime').min()).item()
+        readings = int(time_range.total_seconds() // 300) + 1
+        bucket_minutes = 5 * max(1, -(-readings // max_points))
+        
+        # Average each fuel within the bucket, every fuel shares the same buckets so the stacked areas stay aligned
+        return (
+            generation_data
+            .group_by(pl.col('startTime').dt.truncate(f'{bucket_minutes}m'), 'name')
+            .agg(pl.col('generation').mean())
+            .pivot(on='name', index='startTime', values='generation')
+            .fill_null(0)
+            .sort('startTime')
+        )
+    
     def aggregate_generation_data_by_settlement_date_and_fuel_type(self, generation_data):
             
         # Group by group and name, return max, median and min of generation
@@ -169,31 +446,36 @@ class HistoricGenerationWrangler:
             pl.len().alias('row_count')
         ])
 
-    def plot_aggregated_generation_data(self, aggregated_generation_data):
+    def plot_aggregated_generation_data(self, aggregated_generation_data, fuels=('Wind', 'CCGT', 'Nuclear'), statistics=('max_generation', 'median_generation', 'min_generation'), colors=None):
         
-        # Filter to just wind, CCGT and nuclear
-        aggregated_generation_data = aggregated_generation_data.filter(pl.col('name').is_in(['Wind', 'CCGT', 'Nuclear']))
+        import plotly.graph_objects as go
         
-        aggregated_generation_data = aggregated_generation_data.sort('settlementDate')
+        # Colours default to fuel_colors and can be overridden per fuel
+        colors = {**self.fuel_colors, **(colors or {})}
         
-        # Plot a line for max, median and min generation for each fuel type, make the max a thick sold line, the median a dashed line and the min a thin solid line.
-        # Make the line colour different for each fuel type.
+        # Partition the frame by fuel once, rather than filtering it again for every trace
+        partitions = aggregated_generation_data \
+            .filter(pl.col('name').is_in(list(fuels))) \
+            .sort('settlementDate') \
+            .partition_by('name', as_dict=True, include_key=False)
+        
+        # Plot a line per statistic for each fuel type, by default the max is a thick solid line, the median a dashed line and the min a thin solid line.
+        # The line colour is different for each fuel type.
 
         fig = go.Figure()
 
-        fuel_types = ['Wind', 'CCGT', 'Nuclear']
-        colors = {'Wind': 'green', 'CCGT': 'red', 'Nuclear': 'blue'}
-        line_styles = {'max_generation': 'solid', 'median_generation': 'dash', 'min_generation': 'solid'}
-        line_widths = {'max_generation': 4, 'median_generation': 2, 'min_generation': 1}
-
-        for fuel in fuel_types:
-            for gen_type in ['max_generation', 'median_generation', 'min_generation']:
+        for fuel in fuels:
+            partition = partitions.get((fuel,))
+            if partition is None:
+                continue
+            for statistic in statistics:
+                dash, width = self.statistic_line_styles.get(statistic, ('solid', 2))
                 fig.add_trace(go.Scatter(
-                    x=aggregated_generation_data.filter(pl.col('name') == fuel)['settlementDate'],
-                    y=aggregated_generation_data.filter(pl.col('name') == fuel)[gen_type],
+                    x=partition['settlementDate'],
+                    y=partition[statistic],
                     mode='lines',
-                    name=f'{fuel} {gen_type}',
-                    line=dict(color=colors[fuel], width=line_widths[gen_type], dash=line_styles[gen_type])
+                    name=f'{fuel} {statistic}',
+                    line=dict(color=colors.get(fuel), width=width, dash=dash)
                 ))
 
         fig.update_layout(
@@ -0,0 +1,2 @@
+from .http_transport import HttpTransport # noqa: F401
+from .stub_server import StubServer # noqa: F401
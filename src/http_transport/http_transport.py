@@ -0,0 +1,174 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayBody(io.FileIO):
+    # requests only closes a body it has not fully read, but always releases the connection, which here is the file
+    def release_conn(self):
+        self.close()
+
+
+class HttpTransport:
+
+    MODES = ('live', 'record', 'replay')
+
+    # Response headers that describe the bytes on the wire rather than the decoded body a cassette holds, or carry credentials
+    dropped_response_headers = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'set-cookie'}
+
+    def __init__(self, mode='live', cassette_dir=None, base_urls=None, pool_size=8, chunk_size=4 * 2 ** 20):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {', '.join(self.MODES)}")
+        if mode != 'live' and cassette_dir is None:
+            raise ValueError(f"cassette_dir is needed to {mode} responses")
+
+        # live goes to the network, record goes to the network and saves every response, replay only reads saved responses
+        self.mode = mode
+        self.cassette_dir = None if cassette_dir is None else Path(cassette_dir)
+
+        # URL prefixes to swap before a request is sent, for example to point the public APIs at a local stub server
+        self.base_urls = dict(base_urls or {})
+
+        # Connections are pooled across every wrangler and thread sharing this transport
+        self.pool_size = pool_size
+        self.session = None
+        self.session_lock = threading.Lock()
+
+        # Bytes copied at a time when a streamed response is recorded to disk
+        self.chunk_size = chunk_size
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def request(self, method, url, params=None, headers=None, timeout=None, stream=False, allow_redirects=True):
+
+        # Responses are saved under the request as the wrangler made it, so a recording replays whichever base URL it came from
+        key = self.get_request_key(method, url, params)
+
+        if self.mode == 'replay':
+            return self.replay(key, method, url, stream)
+
+        response = self.get_session().request(
+            method,
+            self.rewrite_url(url),
+            params=params,
+            headers=headers,
+            timeout=timeout,
+            stream=stream or self.mode == 'record',
+            allow_redirects=allow_redirects,
+        )
+
+        if self.mode == 'record':
+            self.record(key, method, url, response)
+            return self.replay(key, method, url, stream)
+
+        return response
+
+    def get_session(self):
+        # Create a single pooled session on first use so concurrent requests reuse connections
+        with self.session_lock:
+            if self.session is None:
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self.session.mount('https://', adapter)
+                self.session.mount('http://', adapter)
+            return self.session
+
+    def rewrite_url(self, url):
+        for base_url, replacement in self.base_urls.items():
+            if url.startswith(base_url):
+                return replacement + url[len(base_url):]
+        return url
+
+    def get_request_key(self, method, url, params=None):
+
+        # Query parameters count the same whether they are in the URL or passed separately, and in any order
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        if params:
+            query += [(str(name), str(value)) for name, value in dict(params).items()]
+
+        # Headers are left out of the key, so credentials such as the Stormglass Authorization header never reach the disk
+        request = {
+            'method': method.upper(),
+            'url': urlunsplit((parts.scheme, parts.netloc, parts.path, '', '')),
+            'params': sorted(query),
+        }
+        return hashlib.sha256(json.dumps(request).encode('utf-8')).hexdigest(), request
+
+    def get_cassette_paths(self, key):
+        digest, _ = key
+        return self.cassette_dir / f'{digest}.json', self.cassette_dir / f'{digest}.body'
+
+    def record(self, key, method, url, response):
+
+        metadata_path, body_path = self.get_cassette_paths(key)
+        self.cassette_dir.mkdir(parents=True, exist_ok=True)
+
+        # The body is copied to disk a chunk at a time, so recording a large stream never holds it all in memory
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.cassette_dir, delete=False) as file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    file.write(chunk)
+        finally:
+            response.close()
+
+        metadata = {
+            'request': key[1],
+            'status_code': response.status_code,
+            'reason': response.reason,
+            'url': url,
+            'headers': {
+                name: value for name, value in response.headers.items()
+                if name.lower() not in self.dropped_response_headers
+            },
+        }
+
+        # Concurrent windows record different keys, and replacing whole files means a reader never sees half a recording
+        os.replace(file.name, body_path)
+        with tempfile.NamedTemporaryFile('w', dir=self.cassette_dir, delete=False) as file:
+            json.dump(metadata, file, indent=2)
+        os.replace(file.name, metadata_path)
+
+        logger.info(f"Recorded {method} {url} ({response.status_code}) to {metadata_path.name}")
+
+    def replay(self, key, method, url, stream=False):
+
+        metadata_path, body_path = self.get_cassette_paths(key)
+        if not metadata_path.is_file() or not body_path.is_file():
+            raise FileNotFoundError(f"No recorded response for {method} {url} in {self.cassette_dir}, record it first with mode='record'")
+
+        with open(metadata_path, 'r') as file:
+            metadata = json.load(file)
+
+        response = requests.Response()
+        response.status_code = metadata['status_code']
+        response.reason = metadata['reason']
+        response.url = metadata['url']
+        response.headers = CaseInsensitiveDict(metadata['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+
+        # A streamed response reads its body from disk as it is iterated, exactly as parse_response reads the network
+        if stream:
+            response.raw = ReplayBody(body_path, 'rb')
+        else:
+            response._content = body_path.read_bytes()
+
+        return response
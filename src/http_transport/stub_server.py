@@ -0,0 +1,236 @@
+import hashlib
+import json
+import math
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StubServer:
+
+    # Origins of the public APIs the wranglers call, every one is answered on the same local port under the same paths
+    ELEXON_ORIGIN = 'https://data.elexon.co.uk'
+    GOV_UK_ORIGIN = 'https://assets.publishing.service.gov.uk'
+    STORMGLASS_ORIGIN = 'https://api.stormglass.io'
+
+    ELEXON_PATH = '/bmrs/api/v1/datasets/FUELINST/stream'
+    STORMGLASS_PATH = '/v2/weather/point'
+
+    # Typical output in MW and the phase of the daily cycle of each FUELINST fuel type served
+    fuel_profiles = {
+        'BIOMASS': (2000, 0.0), 'CCGT': (9000, 0.5), 'COAL': (200, 0.5), 'NPSHYD': (300, 1.0),
+        'NUCLEAR': (4500, 0.0), 'OCGT': (50, 0.5), 'OIL': (0, 0.0), 'OTHER': (400, 0.0),
+        'PS': (300, 2.0), 'WIND': (8000, 3.0), 'INTFR': (1500, 1.5), 'INTIFA2': (900, 1.5),
+        'INTELEC': (900, 1.5), 'INTNED': (800, 1.5), 'INTNEM': (800, 1.5), 'INTNSL': (1200, 1.5),
+        'INTVKL': (1000, 1.5), 'INTEW': (300, 1.5), 'INTIRL': (200, 1.5), 'INTGRNL': (300, 1.5),
+    }
+
+    def __init__(self, host='127.0.0.1', port=0, repd_path=None, daily_quota=500):
+
+        # The REPD spreadsheet is served as it is, from a downloaded or recorded copy, for any .xlsx path under /media
+        self.repd_path = None if repd_path is None else Path(repd_path)
+
+        # Stormglass quota reported in the meta block of every weather response
+        self.daily_quota = daily_quota
+        self.request_count = 0
+        self.request_count_lock = threading.Lock()
+
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exception):
+        self.stop()
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                stub.handle(self, send_body=True)
+
+            def do_HEAD(self):
+                stub.handle(self, send_body=False)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Stub server listening on {self.url}")
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def base_urls(self):
+        # Passed to HttpTransport to send every wrangler to this server
+        return {self.ELEXON_ORIGIN: self.url, self.GOV_UK_ORIGIN: self.url, self.STORMGLASS_ORIGIN: self.url}
+
+    @property
+    def elexon_url(self):
+        return self.url + self.ELEXON_PATH
+
+    @property
+    def stormglass_url(self):
+        return self.url + self.STORMGLASS_PATH
+
+    def handle(self, handler, send_body):
+        parts = urlsplit(handler.path)
+        query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+
+        try:
+            if parts.path == self.ELEXON_PATH:
+                status, headers, body = self.get_fuelinst(query)
+            elif parts.path == self.STORMGLASS_PATH:
+                status, headers, body = self.get_weather_point(query, handler.headers.get('Authorization'))
+            elif parts.path.startswith('/media/') and parts.path.endswith('.xlsx'):
+                status, headers, body = self.get_repd()
+            else:
+                status, headers, body = self.get_error(404, f"No stub for {parts.path}")
+        except (KeyError, ValueError) as exception:
+            status, headers, body = self.get_error(400, f"Bad request: {exception!r}")
+
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if send_body:
+            handler.wfile.write(body)
+
+    def get_error(self, status, message):
+        return status, {'Content-Type': 'application/json'}, json.dumps({'error': message}).encode('utf-8')
+
+    def get_json(self, payload):
+        return 200, {'Content-Type': 'application/json'}, json.dumps(payload).encode('utf-8')
+
+    def parse_time(self, value):
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+    def get_fuelinst(self, query):
+        return self.get_json(self.make_fuelinst_records(
+            self.parse_time(query['publishDateTimeFrom']),
+            self.parse_time(query['publishDateTimeTo']),
+        ))
+
+    def make_fuelinst_records(self, publish_from, publish_to):
+
+        # One reading per fuel type every 5 minutes, the same values for the same time on every run
+        records = []
+        publish_time = publish_from + timedelta(minutes=-publish_from.minute % 5, seconds=-publish_from.second)
+        while publish_time <= publish_to:
+            start_time = publish_time - timedelta(minutes=5)
+            day_fraction = (start_time.hour * 60 + start_time.minute) / 1440
+            days = start_time.timestamp() / 86400
+            for fuel_type, (typical, phase) in self.fuel_profiles.items():
+                # Wind follows a slow weather cycle over several days, everything else follows demand through the day
+                if fuel_type == 'WIND':
+                    level = 0.5 + 0.45 * math.sin(2 * math.pi * days / 5.3) * math.cos(2 * math.pi * days / 1.7)
+                else:
+                    level = 1 + 0.3 * math.sin(2 * math.pi * day_fraction + phase)
+                records.append({
+                    'dataset': 'FUELINST',
+                    'publishTime': publish_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'startTime': start_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'settlementDate': start_time.strftime('%Y-%m-%d'),
+                    'settlementPeriod': start_time.hour * 2 + start_time.minute // 30 + 1,
+                    'fuelType': fuel_type,
+                    'generation': round(typical * level),
+                })
+            publish_time += timedelta(minutes=5)
+
+        return records
+
+    def get_weather_point(self, query, authorization):
+
+        if not authorization:
+            return self.get_error(403, "API key is missing")
+
+        with self.request_count_lock:
+            if self.request_count >= self.daily_quota:
+                return self.get_error(402, "Daily quota exceeded")
+            self.request_count += 1
+            request_count = self.request_count
+
+        return self.get_json(self.make_weather_point_response(
+            float(query['lat']),
+            float(query['lng']),
+            query['params'].split(','),
+            datetime.fromtimestamp(float(query['start']), timezone.utc),
+            datetime.fromtimestamp(float(query['end']), timezone.utc),
+            request_count,
+        ))
+
+    def make_weather_point_response(self, latitude, longitude, parameters, start, end, request_count=1):
+
+        start = start.replace(minute=0, second=0, microsecond=0)
+
+        # Hourly values for every requested parameter, varying smoothly with time and location
+        hours = []
+        time = start
+        while time <= end:
+            hours_since_epoch = time.timestamp() / 3600
+            wave = math.sin(2 * math.pi * hours_since_epoch / 127 + latitude + longitude)
+            values = {
+                'airTemperature': 10 + 5 * wave,
+                'pressure': 1013 + 15 * wave,
+                'windSpeed': max(0.0, 8 + 6 * wave),
+                'windDirection': (225 + 90 * wave) % 360,
+            }
+            hours.append({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+                **{
+                    parameter: {'sg': round(values.get(parameter, 1 + wave), 2)}
+                    for parameter in parameters
+                },
+            })
+            time += timedelta(hours=1)
+
+        return {
+            'hours': hours,
+            'meta': {
+                'dailyQuota': self.daily_quota,
+                'requestCount': request_count,
+                'lat': latitude,
+                'lng': longitude,
+                'params': parameters,
+                'start': start.strftime('%Y-%m-%d %H:%M'),
+                'end': end.strftime('%Y-%m-%d %H:%M'),
+            },
+        }
+
+    def get_repd(self):
+
+        if self.repd_path is None or not self.repd_path.is_file():
+            return self.get_error(404, "No REPD spreadsheet configured for the stub server")
+
+        # Validators change with the file, so the REPD cache revalidates against the stub as it would against gov.uk
+        content = self.repd_path.read_bytes()
+        return 200, {
+            'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            'ETag': f'"{hashlib.sha256(content).hexdigest()[:32]}"',
+            'Last-Modified': formatdate(self.repd_path.stat().st_mtime, usegmt=True),
+        }, content
@@ -0,0 +1 @@
+from .pipeline_instrumentation import PipelineInstrumentation # noqa: F401
@@ -0,0 +1,176 @@
+import json
+import secrets
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import polars as pl
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineInstrumentation:
+
+    # Columns of the summary report, declared so an empty report still has the right shape
+    summary_schema = {
+        'name': pl.String,
+        'calls': pl.UInt32,
+        'errors': pl.UInt32,
+        'total_seconds': pl.Float64,
+        'mean_seconds': pl.Float64,
+        'max_seconds': pl.Float64,
+        'rows_in': pl.Int64,
+        'rows_out': pl.Int64,
+        'bytes_out': pl.Int64,
+    }
+
+    def __init__(self, enabled=True, log_level=logging.INFO, max_spans=10000):
+        self.enabled = enabled
+        self.log_level = log_level
+
+        # Finished spans are kept in memory for the summary report, the oldest are dropped beyond max_spans
+        self.max_spans = max_spans
+        self.spans = []
+        self.spans_lock = threading.Lock()
+
+        # Each thread has its own stack of open spans, so nested stages find their parent
+        self.local = threading.local()
+
+    def get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current_span(self):
+        stack = self.get_stack()
+        return stack[-1] if stack else None
+
+    def span(self, name, **attributes):
+        # Disabled instrumentation hands back a no-op context manager, so callers never need to check
+        if not self.enabled:
+            return nullcontext()
+        return self.record_span(name, self.current_span(), attributes)
+
+    def stage(self, function, name=None):
+
+        # Disabled instrumentation returns the function itself, so the pipeline runs exactly as before
+        if not self.enabled:
+            return function
+
+        name = name or function.__name__
+
+        # Worker threads start with an empty stack, so remember the span the stage was wrapped in
+        parent = self.current_span()
+
+        @wraps(function)
+        def instrumented(*args, **kwargs):
+            with self.record_span(name, parent, {}) as span:
+                if args:
+                    span['attributes'].update(self.describe_frame(args[0], 'in'))
+                result = function(*args, **kwargs)
+                span['attributes'].update(self.describe_frame(result, 'out'))
+            return result
+
+        return instrumented
+
+    @contextmanager
+    def record_span(self, name, parent, attributes):
+
+        # A span opened inside another one on the same thread is its child, otherwise fall back to the given parent
+        parent = self.current_span() or parent
+
+        # Field names follow the OpenTelemetry span model so the logs can be shipped to a tracing backend
+        span = {
+            'trace_id': parent['trace_id'] if parent else secrets.token_hex(16),
+            'span_id': secrets.token_hex(8),
+            'parent_span_id': parent['span_id'] if parent else None,
+            'name': name,
+            'start_time_unix_nano': time.time_ns(),
+            'end_time_unix_nano': None,
+            'duration_seconds': None,
+            'status': 'OK',
+            'attributes': dict(attributes),
+        }
+
+        stack = self.get_stack()
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as exception:
+            span['status'] = 'ERROR'
+            span['attributes']['error'] = repr(exception)
+            raise
+        finally:
+            span['duration_seconds'] = time.perf_counter() - start
+            span['end_time_unix_nano'] = time.time_ns()
+            stack.pop()
+            self.finish_span(span)
+
+    def describe_frame(self, frame, direction):
+        # Lazy frames have no rows until they are collected, so only eager frames are measured
+        if isinstance(frame, pl.DataFrame):
+            attributes = {f'rows_{direction}': frame.height}
+            if direction == 'out':
+                attributes['bytes_out'] = frame.estimated_size()
+            return attributes
+        return {}
+
+    def finish_span(self, span):
+        with self.spans_lock:
+            self.spans.append(span)
+            if len(self.spans) > self.max_spans:
+                del self.spans[:len(self.spans) - self.max_spans]
+
+        # The message is the span as JSON, and the span itself rides along for structured log handlers
+        logger.log(self.log_level, json.dumps(span, default=str), extra={'span': span})
+
+    def get_spans(self, trace_id=None):
+        with self.spans_lock:
+            spans = list(self.spans)
+        if trace_id is not None:
+            spans = [span for span in spans if span['trace_id'] == trace_id]
+        return spans
+
+    def reset(self):
+        with self.spans_lock:
+            self.spans = []
+
+    def summary(self, trace_id=None):
+
+        spans = self.get_spans(trace_id)
+        if not spans:
+            return pl.DataFrame(schema=self.summary_schema)
+
+        frame = pl.DataFrame(
+            {
+                'name': [span['name'] for span in spans],
+                'status': [span['status'] for span in spans],
+                'duration_seconds': [span['duration_seconds'] for span in spans],
+                'rows_in': [span['attributes'].get('rows_in') for span in spans],
+                'rows_out': [span['attributes'].get('rows_out') for span in spans],
+                'bytes_out': [span['attributes'].get('bytes_out') for span in spans],
+            },
+            schema_overrides={'rows_in': pl.Int64, 'rows_out': pl.Int64, 'bytes_out': pl.Int64},
+        )
+
+        # One row per stage name, slowest first, rows and sizes are the largest seen in any call
+        return (
+            frame
+            .group_by('name', maintain_order=True)
+            .agg(
+                pl.len().cast(pl.UInt32).alias('calls'),
+                (pl.col('status') == 'ERROR').sum().cast(pl.UInt32).alias('errors'),
+                pl.col('duration_seconds').sum().alias('total_seconds'),
+                pl.col('duration_seconds').mean().alias('mean_seconds'),
+                pl.col('duration_seconds').max().alias('max_seconds'),
+                pl.col('rows_in').max(),
+                pl.col('rows_out').max(),
+                pl.col('bytes_out').max(),
+            )
+            .sort('total_seconds', descending=True)
+            .select(list(self.summary_schema))
+        )
@@ -1 +1,3 @@
 from .renewable_locations_wrangler  import RenewableLocationsWrangler  # noqa: F401
+from .site_clusterer import SiteClusterer # noqa: F401
+from .installed_capacity import InstalledCapacity # noqa: F401
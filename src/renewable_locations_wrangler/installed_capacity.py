@@ -0,0 +1,137 @@
+from datetime import datetime
+
+import polars as pl
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InstalledCapacity:
+
+    def __init__(self, by=None):
+        # Optional columns to split capacity by, for example ['technology_type'], ['region'] or ['cluster']
+        self.by = list(by or [])
+
+        # Capacity added on each operational date per group, the cumulative step function is derived from this
+        self.change_points = pl.DataFrame(
+            schema={**{column: pl.Null for column in self.by}, 'date': pl.Date, 'daily_installed_capacity_mw': pl.Float64}
+        )
+
+        # The latest record counted for each site, the change points are derived from these
+        self.sites = pl.DataFrame(
+            schema={
+                'ref_id': pl.Int64,
+                **{column: pl.Null for column in self.by},
+                'date_operational': pl.Date,
+                'installed_capacity_mw': pl.Float64,
+            }
+        )
+
+    def update(self, sites):
+
+        # A site only counts once it has an operational date and a capacity, so one missing either is picked up by a later extract
+        sites = sites.drop_nulls(subset=['date_operational', 'installed_capacity_mw'])
+        if sites.is_empty():
+            return self
+
+        if 'ref_id' not in sites.columns:
+            sites = sites.with_columns(pl.lit(None, dtype=pl.Int64).alias('ref_id'))
+        sites = sites.select(
+            pl.col('ref_id').cast(pl.Int64),
+            *self.by,
+            pl.col('date_operational').cast(pl.Date),
+            pl.col('installed_capacity_mw').cast(pl.Float64),
+        )
+
+        # Group columns take their types from the first sites seen
+        if self.sites.is_empty():
+            self.sites = pl.DataFrame(schema=sites.schema)
+
+        # A site seen again replaces its earlier record, so the full REPD extract can be passed in each month and revised
+        # dates or capacities move the site's capacity rather than adding to it, sites without a ref_id are always added
+        identified = sites.filter(pl.col('ref_id').is_not_null()).unique(subset=['ref_id'], keep='last', maintain_order=True)
+        changed = identified.join(self.sites, on=identified.columns, how='anti', nulls_equal=True)
+        revised = changed.join(self.sites, on='ref_id', how='semi').height
+
+        self.sites = pl.concat(
+            [
+                self.sites.filter(~pl.col('ref_id').is_in(changed['ref_id'].implode()) | pl.col('ref_id').is_null()),
+                changed,
+                sites.filter(pl.col('ref_id').is_null()),
+            ],
+            how='vertical_relaxed',
+        )
+
+        self.change_points = (
+            self.sites
+            .group_by(self.by + ['date_operational'])
+            .agg(pl.col('installed_capacity_mw').sum().alias('daily_installed_capacity_mw'))
+            .rename({'date_operational': 'date'})
+            .sort(self.by + ['date'])
+        )
+
+        logger.info(f"Installed capacity updated with {changed.height - revised} new and {revised} revised sites")
+
+        return self
+
+    def get_change_points(self):
+        cumulative = pl.col('daily_installed_capacity_mw').cum_sum()
+        if self.by:
+            cumulative = cumulative.over(self.by)
+        return self.change_points.with_columns(cumulative.alias('cumulative_installed_capacity_mw'))
+
+    def at(self, frame, on='time'):
+
+        # As-of lookup of the cumulative capacity at each time in frame, capacity is zero before the first site
+        frame = frame.lazy()
+        dtype = frame.collect_schema()[on]
+
+        change_points = self.get_change_points().lazy().select(
+            *self.by,
+            self.cast_date_to(pl.col('date'), dtype).alias(on),
+            'cumulative_installed_capacity_mw',
+        )
+
+        # Both sides are sorted on the time column here, which Polars cannot verify itself once by groups are used
+        return (
+            frame
+            .sort(on)
+            .join_asof(
+                change_points.sort(on),
+                on=on,
+                by=self.by or None,
+                strategy='backward',
+                check_sortedness=not self.by,
+            )
+            .with_columns(pl.col('cumulative_installed_capacity_mw').fill_null(0))
+        )
+
+    def expand(self, start=None, end=None, interval='1d'):
+
+        # Lazily build the capacity at every step of the requested grain, for example '5m', '30m' or '1d'
+        if start is None:
+            start = self.change_points['date'].min()
+        if end is None:
+            end = datetime.today().date()
+
+        times = pl.LazyFrame().select(
+            pl.datetime_range(start, end, interval, time_unit='us').alias('time')
+        )
+
+        # Every group gets its own copy of the time grid
+        if self.by:
+            groups = self.change_points.lazy().select(self.by).unique()
+            times = times.join(groups, how='cross')
+
+        return self.at(times, on='time')
+
+    def cast_date_to(self, date, dtype):
+        if dtype == pl.Date:
+            return date
+        if isinstance(dtype, pl.Datetime):
+            date = date.cast(pl.Datetime(dtype.time_unit or 'us'))
+            if dtype.time_zone is not None:
+                date = date.dt.replace_time_zone(dtype.time_zone)
+            return date
+        raise ValueError(f"Cannot look up installed capacity on a column of type {dtype}")
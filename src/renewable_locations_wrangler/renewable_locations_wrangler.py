@@ -1,62 +1,191 @@
 import polars as pl
-import requests
 import io
-import plotly.express as px
+import json
+import hashlib
+import shutil
+from pathlib import Path
 
-import polars as pl
-from datetime import datetime, timedelta
+import logging
 
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+from pipeline_instrumentation import PipelineInstrumentation
 
-import logging
-# Set logging level to info
-logging.basicConfig(level=logging.INFO)
+from .site_clusterer import SiteClusterer
+from .installed_capacity import InstalledCapacity
 
-from pyproj import Transformer
+logger = logging.getLogger(__name__)
 
 class RenewableLocationsWrangler:
     
-    def __init__(self, gov_uk_url=None):
+    # Shared EPSG:27700 to EPSG:4326 transformer, created on first use by get_transformer
+    transformer = None
+    
+    def __init__(self, gov_uk_url=None, cache_dir=None, revalidate=True, clusterer=None, instrumentation=None, transport=None):
         if gov_uk_url is None:
             # "https://assets.publishing.service.gov.uk/media/673b215249ce28002166a93e/repd-q3-oct-2024.csv"
             self.gov_uk_url = "https://assets.publishing.service.gov.uk/media/673b218149ce28002166a940/repd-q3-oct-2024.xlsx"
         else:
             self.gov_uk_url = gov_uk_url
+        
+        # Optional on-disk cache of the parsed and pruned REPD frame, keyed by URL and response validators
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.revalidate = revalidate
+        
+        # Clustering stage used by add_cluster_labels, a saved SiteClusterer can be passed in to warm start it
+        self.clusterer = clusterer
+        
+        # Opt-in per stage timing, a disabled instance leaves every stage unwrapped
+        if instrumentation is None:
+            instrumentation = PipelineInstrumentation(enabled=False)
+        self.instrumentation = instrumentation
+        
+        # Shared transport for the download, created by get_transport on first use when none is passed in
+        self.transport = transport
             
-    def get_renewable_locations(self):
-    
-        # Using piping to chain the methods together
-        return (
-            self.download_data() \
-            .pipe(self.prune_and_rename_columns) \
-            .pipe(self.select_only_operational_sites) \
-            .pipe(self.select_only_wind_sites) \
-            .pipe(self.convert_coordinates) \
-            .pipe(self.drop_nulls_in_coordinates) \
-            .pipe(self.drop_nulls_in_date_operational) \
-            .pipe(self.fill_na_in_installed_capacity_mw) \
-            .pipe(self.add_cluster_labels)
-        )
+    def get_renewable_locations(self, wind_only=True):
+        
+        stage = self.instrumentation.stage
+        
+        with self.instrumentation.span('get_renewable_locations'):
+            
+            df = stage(self.load_data)().pipe(stage(self.select_only_operational_sites))
+            
+            if wind_only:
+                df = df.pipe(stage(self.select_only_wind_sites))
+        
+            # Using piping to chain the methods together
+            return (
+                df \
+                .pipe(stage(self.drop_nulls_in_coordinates)) \
+                .pipe(stage(self.convert_coordinates)) \
+                .pipe(stage(self.drop_nulls_in_date_operational)) \
+                .pipe(stage(self.fill_na_in_installed_capacity_mw)) \
+                .pipe(stage(self.add_cluster_labels))
+            )
+    
+    def load_data(self):
+        
+        # Without a cache directory always download and parse the spreadsheet
+        if self.cache_dir is None:
+            return self.download_data().pipe(self.instrumentation.stage(self.prune_and_rename_columns))
+        
+        metadata = self.read_cache_metadata()
+        
+        if metadata is not None:
+            
+            # A warm start can skip the network entirely when revalidation is switched off
+            if not self.revalidate:
+                logger.info(f"Loading REPD data from cache without revalidation: {self.get_cached_data_path(metadata)}")
+                return pl.read_parquet(self.get_cached_data_path(metadata))
+            
+            # Otherwise check the ETag / Last-Modified validators with a HEAD request before trusting the cache
+            import requests
+            try:
+                validators = self.get_response_validators(self.get_transport().head(self.gov_uk_url, allow_redirects=True))
+            except (requests.RequestException, FileNotFoundError) as exception:
+                # A replay transport with no recorded HEAD raises FileNotFoundError, which is as good as offline here
+                logger.warning(f"Could not revalidate REPD cache, using cached copy: {exception}")
+                return pl.read_parquet(self.get_cached_data_path(metadata))
+            
+            if any(validators.values()) and validators == metadata["validators"]:
+                logger.info(f"REPD cache is up to date: {self.get_cached_data_path(metadata)}")
+                return pl.read_parquet(self.get_cached_data_path(metadata))
+        
+        response = self.instrumentation.stage(self.fetch_data)()
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        validators = self.get_response_validators(response)
+        
+        # The server may not send validators, so an unchanged content hash still lets us skip the xlsx parse
+        if metadata is not None and metadata["content_hash"] == content_hash:
+            logger.info("REPD content is unchanged, reusing the cached parse")
+            df = pl.read_parquet(self.get_cached_data_path(metadata))
+        else:
+            df = self.instrumentation.stage(self.parse_data)(response.content) \
+                .pipe(self.instrumentation.stage(self.prune_and_rename_columns))
+        
+        self.write_cache(df, {"url": self.gov_uk_url, "validators": validators, "content_hash": content_hash})
+        
+        return df
             
     def download_data(self):
+        return self.instrumentation.stage(self.parse_data)(self.instrumentation.stage(self.fetch_data)().content)
+    
+    def get_transport(self):
+        
+        # requests is only imported when the spreadsheet actually has to be downloaded
+        if self.transport is None:
+            from http_transport import HttpTransport
+            self.transport = HttpTransport(pool_size=1)
+        return self.transport
+    
+    def fetch_data(self):
         
         # Set up stream to download data
-        response = requests.get(self.gov_uk_url)
+        response = self.get_transport().get(self.gov_uk_url)
         
         # Check if the request was successful
         if response.status_code != 200:
             raise ValueError(f"Failed to download data from {self.gov_uk_url}")
+        
+        return response
+    
+    def parse_data(self, content):
                
         # Convert string content to file-like object
-        stream = io.BytesIO(response.content)
+        stream = io.BytesIO(content)
         
         # Read the CSV data into a Polars DataFrame
         df = pl.read_excel(stream, sheet_name="REPD")
         
-        logging.info(f"Downloaded {len(df)} rows of data with the following column names:\n {df.columns}")
+        logger.info(f"Downloaded {len(df)} rows of data with the following column names:\n {df.columns}")
         
         return df
+    
+    def get_response_validators(self, response):
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+    
+    def get_cache_path(self):
+        # Each URL gets its own directory so that different REPD extracts can be cached side by side
+        url_hash = hashlib.sha256(self.gov_uk_url.encode("utf-8")).hexdigest()[:16]
+        return self.cache_dir / url_hash
+    
+    def get_cached_data_path(self, metadata):
+        return self.get_cache_path() / f"{metadata['content_hash']}.parquet"
+    
+    def read_cache_metadata(self):
+        metadata_path = self.get_cache_path() / "metadata.json"
+        if not metadata_path.is_file():
+            return None
+        
+        with open(metadata_path, "r") as file:
+            metadata = json.load(file)
+        
+        # Treat a cache whose data file has gone missing as empty
+        if not self.get_cached_data_path(metadata).is_file():
+            return None
+        
+        return metadata
+    
+    def write_cache(self, df, metadata):
+        cache_path = self.get_cache_path()
+        cache_path.mkdir(parents=True, exist_ok=True)
+        
+        # Write the data before the metadata that points at it, then remove data files from earlier versions
+        data_path = self.get_cached_data_path(metadata)
+        df.write_parquet(data_path)
+        with open(cache_path / "metadata.json", "w") as file:
+            json.dump(metadata, file, indent=2)
+        
+        for stale_path in cache_path.glob("*.parquet"):
+            if stale_path != data_path:
+                stale_path.unlink()
+    
+    def invalidate_cache(self):
+        if self.cache_dir is not None and self.get_cache_path().exists():
+            logger.info(f"Removing REPD cache at {self.get_cache_path()}")
+            shutil.rmtree(self.get_cache_path())
 
     def prune_and_rename_columns(self, df):
         
@@ -95,22 +224,29 @@ class RenewableLocationsWrangler:
     def select_only_wind_sites(self, df):
         return df.filter(pl.col("technology_type").str.starts_with("Wind"))
 
+    def get_transformer(self):
+        # Building a PROJ transformer is expensive, so build it once and share it across instances and calls
+        if RenewableLocationsWrangler.transformer is None:
+            from pyproj import Transformer
+            RenewableLocationsWrangler.transformer = Transformer.from_crs("epsg:27700", "epsg:4326")
+        return RenewableLocationsWrangler.transformer
+
     def convert_coordinates(self, df):
         
-        transformer = Transformer.from_crs("epsg:27700", "epsg:4326")
-        
-        def transform_coords(x, y):
-            lat, lon = transformer.transform(x, y)
-            return lat, lon
+        transformer = self.get_transformer()
         
-        # Apply the transformation to each row
-        coords = df.select(["x_coordinate", "y_coordinate"]).to_numpy()
-        latitudes, longitudes = zip(*[transform_coords(x, y) for x, y in coords])
+        # Convert the whole coordinate columns in a single call, null coordinates are passed through as NaN
+        x_coordinates = df["x_coordinate"].cast(pl.Float64, strict=False).fill_null(float("nan")).to_numpy()
+        y_coordinates = df["y_coordinate"].cast(pl.Float64, strict=False).fill_null(float("nan")).to_numpy()
+        latitudes, longitudes = transformer.transform(x_coordinates, y_coordinates)
         
-        # Add the new columns to the DataFrame
+        # PROJ returns inf for NaN input, so map anything non-finite back to null
         df = df.with_columns([
             pl.Series("latitude", latitudes),
             pl.Series("longitude", longitudes)
+        ]).with_columns([
+            pl.when(pl.col(column).is_finite()).then(pl.col(column)).otherwise(None).alias(column)
+            for column in ["latitude", "longitude"]
         ])
         
         return df
@@ -127,20 +263,16 @@ class RenewableLocationsWrangler:
     
     def add_cluster_labels(self, df, number_of_clusters=80):
         
-        df = df.with_columns([pl.col("technology_type")
-            .cast(pl.Categorical)
-            .to_physical()
-            .alias("technology_type_int")])
-        
-        coords = df[['latitude', 'longitude', 'technology_type_int']]
-        
-        # Scale latitude and longitude using Sclearn standard scalar
-        scaler = StandardScaler()
-        coords[['latitude', 'longitude']] = scaler.fit_transform(coords[['latitude', 'longitude']])
+        if self.clusterer is None:
+            self.clusterer = SiteClusterer(number_of_clusters=number_of_clusters)
         
-        kmeans_model = KMeans(n_clusters=number_of_clusters, random_state=0)
+        # A fitted clusterer is only updated with sites it has not seen, otherwise it is fitted from scratch
+        if self.clusterer.is_fitted():
+            self.instrumentation.stage(self.clusterer.update, 'update_clusters')(df)
+        else:
+            self.instrumentation.stage(self.clusterer.fit, 'fit_clusters')(df)
 
-        clusters = kmeans_model.fit_predict(coords)
+        clusters = self.instrumentation.stage(self.clusterer.predict, 'predict_clusters')(df)
 
         df = df.with_columns(pl.Series(name="cluster", values=clusters))
         
@@ -159,6 +291,9 @@ class RenewableLocationsWrangler:
         return cluster_centers
     
     def plot_locations(self, df, color_column="technology_type"):
+        
+        # Plotly is only imported when a chart is drawn, so data-only jobs never pay for it
+        import plotly.express as px
     
         # Calculate the mean latitude and longitude for centering the map
         center_lat = df.select(pl.col("latitude").mean()).item()
@@ -186,40 +321,22 @@ class RenewableLocationsWrangler:
         
         return fig
 
-    def compute_cumulative_installed_capacity(self, df):
+    def compute_cumulative_installed_capacity(self, df, by=None, interval='1d'):
 
-        # Group by date_operational and sum the installed_capacity_mw
-        df = df.group_by('date_operational').agg(pl.sum('installed_capacity_mw').alias('daily_installed_capacity_mw'))
+        # Cumulative capacity is a step function over the operational dates, expanded lazily to the requested grain
+        installed_capacity = InstalledCapacity(by=by).update(df)
         
-        # Rename the date_operational column to date
-        df = df.rename({'date_operational': 'date'})
-
-        # Sort the DataFrame by the date_operational column
-        df = df.sort('date')
+        result_df = installed_capacity.expand(interval=interval).collect()
         
-        # Compute the cumulative sum of the daily_installed_capacity_mw column
-        df = df.with_columns([pl.col('daily_installed_capacity_mw').cum_sum().alias('cumulative_installed_capacity_mw')])
-        
-        # Generate a date range from the earliest date_operational to today's date
-        start_date = df['date'].min()
-        end_date = datetime.today().date()
-        date_range = pl.date_range(start_date, end_date, interval='1d', eager=True)
-        date_range_dataframe = pl.DataFrame({'date': date_range})
-        
-        # Join the date range with the cumulative capacity DataFrame
-        result_df = date_range_dataframe.join(df, on='date', how='left')
-        
-        # Fill forward the cumulative_installed_capacity_mw column to fill missing values
-        result_df = result_df.with_columns([
-            pl.col('cumulative_installed_capacity_mw').fill_null(strategy='forward')
-        ])
-        
-        # Drop the daily_installed_capacity_mw column
-        result_df = result_df.drop('daily_installed_capacity_mw')
+        # Keep the daily output keyed by date as before
+        if interval == '1d':
+            result_df = result_df.with_columns(pl.col('time').dt.date()).rename({'time': 'date'})
         
         return result_df
 
     def plot_cumulative_installed_capacity(self, df):
+        
+        import plotly.express as px
     
         fig = px.line(
             df,
@@ -0,0 +1,210 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SiteClusterer:
+
+    METHODS = ['kmeans', 'minibatch']
+
+    def __init__(self, number_of_clusters=80, method='kmeans', technology_weight=0.5, batch_size=1024, max_iter=100, random_state=0):
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {self.METHODS}, got {method}")
+
+        self.number_of_clusters = number_of_clusters
+        self.method = method
+        self.technology_weight = technology_weight
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.random_state = random_state
+
+        # Fitted state, everything needed to reproduce predictions is saved by save()
+        self.scaler_mean = None
+        self.scaler_scale = None
+        self.technology_types = []
+        self.cluster_centers = None
+        self.cluster_counts = None
+        self.known_ref_ids = set()
+
+    def is_fitted(self):
+        return self.cluster_centers is not None
+
+    def build_features(self, df):
+
+        # Standardise latitude and longitude with the scaling learnt at fit time so warm started centroids stay comparable
+        coordinates = df.select(['latitude', 'longitude']).to_numpy()
+        scaled_coordinates = (coordinates - self.scaler_mean) / self.scaler_scale
+
+        # One-hot encode the technology type so it is on the same scale as the coordinates rather than an arbitrary integer code
+        technology_index = {technology_type: index for index, technology_type in enumerate(self.technology_types)}
+        columns = df['technology_type'].replace_strict(technology_index, default=-1, return_dtype=pl.Int64).to_numpy()
+        known = columns >= 0
+        one_hot = np.zeros((df.height, len(self.technology_types)))
+        one_hot[np.flatnonzero(known), columns[known]] = self.technology_weight
+
+        return np.hstack([scaled_coordinates, one_hot])
+
+    def add_technology_types(self, df):
+
+        # Unseen technology types get a new feature column, existing centroids get a zero in that column
+        new_technology_types = sorted(set(df['technology_type'].drop_nulls().unique()) - set(self.technology_types))
+        if new_technology_types:
+            self.technology_types = self.technology_types + new_technology_types
+            if self.cluster_centers is not None:
+                self.cluster_centers = np.hstack(
+                    [self.cluster_centers, np.zeros((self.cluster_centers.shape[0], len(new_technology_types)))]
+                )
+
+    def fit(self, df):
+
+        coordinates = df.select(['latitude', 'longitude']).to_numpy()
+
+        # Keep the saved scaling on a warm start, otherwise learn it from this data
+        if not self.is_fitted():
+            self.scaler_mean = coordinates.mean(axis=0)
+            self.scaler_scale = coordinates.std(axis=0)
+            self.scaler_scale[self.scaler_scale == 0] = 1.0
+
+        self.add_technology_types(df)
+        features = self.build_features(df)
+
+        number_of_clusters = min(self.number_of_clusters, len(features))
+
+        # Warm start from the previous centroids when they are available
+        if self.is_fitted() and self.cluster_centers.shape[0] == number_of_clusters:
+            init, n_init = self.cluster_centers, 1
+        else:
+            init, n_init = 'k-means++', 'auto'
+
+        # scikit-learn takes seconds to import, so it is only loaded when clusters are actually fitted
+        from sklearn.cluster import KMeans, MiniBatchKMeans
+        
+        if self.method == 'kmeans':
+            model = KMeans(n_clusters=number_of_clusters, init=init, n_init=n_init, max_iter=self.max_iter, random_state=self.random_state)
+        else:
+            model = MiniBatchKMeans(n_clusters=number_of_clusters, init=init, n_init=n_init, max_iter=self.max_iter, batch_size=self.batch_size, random_state=self.random_state)
+
+        labels = model.fit_predict(features)
+
+        self.cluster_centers = model.cluster_centers_
+        self.cluster_counts = np.bincount(labels, minlength=number_of_clusters).astype(float)
+        self.known_ref_ids = set(df['ref_id'].to_list()) if 'ref_id' in df.columns else set()
+
+        logger.info(f"Fitted {number_of_clusters} clusters to {len(features)} sites using {self.method}")
+
+        return self
+
+    def partial_fit(self, df):
+
+        if not self.is_fitted():
+            return self.fit(df)
+
+        if df.is_empty():
+            return self
+
+        self.add_technology_types(df)
+        features = self.build_features(df)
+        labels = self.predict_features(features)
+
+        # Mini-batch k-means update: each centroid moves towards the mean of its new sites, weighted by how many sites it already holds
+        new_counts = np.bincount(labels, minlength=self.cluster_centers.shape[0]).astype(float)
+        new_sums = np.zeros_like(self.cluster_centers)
+        np.add.at(new_sums, labels, features)
+
+        total_counts = self.cluster_counts + new_counts
+        updated = new_counts > 0
+        self.cluster_centers[updated] = (
+            self.cluster_centers[updated] * self.cluster_counts[updated, None] + new_sums[updated]
+        ) / total_counts[updated, None]
+        self.cluster_counts = total_counts
+
+        if 'ref_id' in df.columns:
+            self.known_ref_ids.update(df['ref_id'].to_list())
+
+        logger.info(f"Updated {int(updated.sum())} clusters with {len(features)} new sites")
+
+        return self
+
+    def update(self, df):
+
+        # Only sites that have not been seen before move the centroids, so re-running on a full extract is cheap
+        if not self.is_fitted():
+            return self.fit(df)
+
+        if 'ref_id' not in df.columns:
+            return self.partial_fit(df)
+
+        new_sites = df.filter(~pl.col('ref_id').is_in(list(self.known_ref_ids)))
+        return self.partial_fit(new_sites)
+
+    def predict_features(self, features):
+        # Squared distances via |x|^2 - 2x.c + |c|^2 avoids building a sites x clusters x features array
+        distances = (
+            (features ** 2).sum(axis=1)[:, None]
+            - 2 * features @ self.cluster_centers.T
+            + (self.cluster_centers ** 2).sum(axis=1)[None, :]
+        )
+        return distances.argmin(axis=1)
+
+    def predict(self, df):
+        if not self.is_fitted():
+            raise ValueError("SiteClusterer must be fitted before predicting")
+        return self.predict_features(self.build_features(df))
+
+    def fit_predict(self, df):
+        return self.fit(df).predict(df)
+
+    def save(self, path):
+        if not self.is_fitted():
+            raise ValueError("SiteClusterer must be fitted before saving")
+
+        state = {
+            'number_of_clusters': self.number_of_clusters,
+            'method': self.method,
+            'technology_weight': self.technology_weight,
+            'batch_size': self.batch_size,
+            'max_iter': self.max_iter,
+            'random_state': self.random_state,
+            'scaler_mean': self.scaler_mean.tolist(),
+            'scaler_scale': self.scaler_scale.tolist(),
+            'technology_types': self.technology_types,
+            'cluster_centers': self.cluster_centers.tolist(),
+            'cluster_counts': self.cluster_counts.tolist(),
+            'known_ref_ids': sorted(self.known_ref_ids),
+        }
+
+        # Sorted keys and ids give byte-identical files for identical models
+        with open(path, 'w') as file:
+            json.dump(state, file, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+
+        if not Path(path).is_file():
+            raise FileNotFoundError(f"No saved SiteClusterer found at {path}")
+
+        with open(path, 'r') as file:
+            state = json.load(file)
+
+        clusterer = cls(
+            number_of_clusters=state['number_of_clusters'],
+            method=state['method'],
+            technology_weight=state['technology_weight'],
+            batch_size=state['batch_size'],
+            max_iter=state['max_iter'],
+            random_state=state['random_state'],
+        )
+        clusterer.scaler_mean = np.array(state['scaler_mean'])
+        clusterer.scaler_scale = np.array(state['scaler_scale'])
+        clusterer.technology_types = state['technology_types']
+        clusterer.cluster_centers = np.array(state['cluster_centers'])
+        clusterer.cluster_counts = np.array(state['cluster_counts'])
+        clusterer.known_ref_ids = set(state['known_ref_ids'])
+
+        return clusterer
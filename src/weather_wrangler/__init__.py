@@ -1 +1,2 @@
 from .weather_wrangler import WeatherWrangler # noqa: F401
+from .weather_cache import WeatherCache # noqa: F401
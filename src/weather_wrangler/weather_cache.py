@@ -0,0 +1,134 @@
+import json
+import shutil
+import threading
+from pathlib import Path
+
+import arrow
+import polars as pl
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WeatherCache:
+
+    def __init__(self, cache_dir, precision=2):
+        # Points are rounded to precision decimal places (2 is roughly 1km) so nearby requests share a cache entry
+        self.cache_dir = Path(cache_dir)
+        self.precision = precision
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def round_point(self, latitude, longitude):
+        return round(latitude, self.precision), round(longitude, self.precision)
+
+    def get_point_path(self, latitude, longitude):
+        latitude, longitude = self.round_point(latitude, longitude)
+        return self.cache_dir / f"{latitude:.{self.precision}f}_{longitude:.{self.precision}f}"
+
+    def get_lock(self, latitude, longitude):
+        # One lock per point so that concurrent batch requests for the same point do not interleave their writes
+        key = self.round_point(latitude, longitude)
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def read_coverage(self, latitude, longitude):
+        coverage_path = self.get_point_path(latitude, longitude) / "coverage.json"
+        if not coverage_path.is_file():
+            return []
+
+        with open(coverage_path, "r") as file:
+            return [(arrow.get(start), arrow.get(end)) for start, end in json.load(file)]
+
+    def write_coverage(self, latitude, longitude, coverage):
+        with open(self.get_point_path(latitude, longitude) / "coverage.json", "w") as file:
+            json.dump([[start.isoformat(), end.isoformat()] for start, end in coverage], file, indent=2)
+
+    def merge_ranges(self, ranges):
+        # Combine overlapping or touching hourly ranges, both ends of a range are inclusive
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1].shift(hours=1):
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def floor_to_hour(self, time):
+        return arrow.get(time).to("UTC").floor("hour")
+
+    def get_missing_ranges(self, latitude, longitude, start_time, end_time):
+
+        start_time = self.floor_to_hour(start_time)
+        end_time = self.floor_to_hour(end_time)
+
+        # Walk the covered ranges in order and collect the gaps between them inside the requested range
+        missing = []
+        cursor = start_time
+        for covered_start, covered_end in self.read_coverage(latitude, longitude):
+            if covered_end < cursor:
+                continue
+            if covered_start > end_time:
+                break
+            if covered_start > cursor:
+                missing.append((cursor, covered_start.shift(hours=-1)))
+            cursor = covered_end.shift(hours=1)
+            if cursor > end_time:
+                break
+
+        if cursor <= end_time:
+            missing.append((cursor, end_time))
+
+        return missing
+
+    def store(self, latitude, longitude, start_time, end_time, weather_data):
+
+        point_path = self.get_point_path(latitude, longitude)
+        point_path.mkdir(parents=True, exist_ok=True)
+        data_path = point_path / "observations.parquet"
+
+        # Only the hours Stormglass actually returned are covered, never later than the current hour, so a window that ran
+        # past now or a short response is fetched again next time
+        covered = None
+        if weather_data.height > 0:
+            covered_start = max(self.floor_to_hour(start_time), self.floor_to_hour(weather_data["time"].min()))
+            covered_end = min(self.floor_to_hour(end_time), self.floor_to_hour(weather_data["time"].max()), self.floor_to_hour(arrow.utcnow()))
+            if covered_start <= covered_end:
+                covered = (covered_start, covered_end)
+
+        # New observations replace stored ones for the same hour
+        if data_path.is_file():
+            weather_data = pl.concat([pl.read_parquet(data_path), weather_data], how="diagonal_relaxed")
+        weather_data = weather_data.unique(subset=["time"], keep="last").sort("time")
+        weather_data.write_parquet(data_path)
+
+        if covered is not None:
+            coverage = self.read_coverage(latitude, longitude)
+            coverage.append(covered)
+            self.write_coverage(latitude, longitude, self.merge_ranges(coverage))
+
+        logger.info(f"Cached {len(weather_data)} hours of weather data at {point_path}")
+
+    def load(self, latitude, longitude, start_time, end_time):
+
+        data_path = self.get_point_path(latitude, longitude) / "observations.parquet"
+        if not data_path.is_file():
+            return pl.DataFrame()
+
+        start_time = self.floor_to_hour(start_time).naive
+        end_time = self.floor_to_hour(end_time).naive
+
+        return pl.read_parquet(data_path).filter(pl.col("time").is_between(start_time, end_time))
+
+    def invalidate(self, latitude=None, longitude=None):
+        # Remove a single point, or the whole cache when no point is given
+        if latitude is None or longitude is None:
+            path = self.cache_dir
+        else:
+            path = self.get_point_path(latitude, longitude)
+
+        if path.exists():
+            shutil.rmtree(path)
@@ -1,11 +1,24 @@
 import datetime
-import pandas as pd
+from email.utils import parsedate_to_datetime
+import polars as pl
 import arrow
 import requests
 
 import yaml
 from pathlib import Path
 
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import logging
+
+from http_transport import HttpTransport
+
+from .weather_cache import WeatherCache
+
+logger = logging.getLogger(__name__)
+
 
 class WeatherWrangler:
     
@@ -30,19 +43,49 @@ class WeatherWrangler:
     
     CONFIG_FILE = "config.yaml"
     
-    def __init__(self):
+    STORMGLASS_URL = "https://api.stormglass.io/v2/weather/point"
+    
+    def __init__(self, stormglass_url=None, max_workers=4, max_retries=5, timeout=30, cache_dir=None, api_key=None, transport=None):
 
-        # Check config file exists
-        if not Path(self.CONFIG_FILE).is_file():
-            raise FileNotFoundError("Config file not found. Please create a config file with the api_key")
-        
-        # Store api_key in a local config.yaml file and load it from their during initialization
-        with open(self.CONFIG_FILE, "r") as file:
-            self.config = yaml.safe_load(file)
+        # An api_key passed in directly, for example for offline runs against fixtures, skips the config file
+        if api_key is not None:
+            self.config = {"stormglass_weather": {"api_key": api_key}}
+        else:
+            # Check config file exists
+            if not Path(self.CONFIG_FILE).is_file():
+                raise FileNotFoundError("Config file not found. Please create a config file with the api_key")
+            
+            # Store api_key in a local config.yaml file and load it from their during initialization
+            with open(self.CONFIG_FILE, "r") as file:
+                self.config = yaml.safe_load(file)
         
         self.api_key = (
             self.config["stormglass_weather"]["api_key"]
         )
+        
+        # The URL can be pointed at a local stub server for testing
+        if stormglass_url is None:
+            self.stormglass_url = self.STORMGLASS_URL
+        else:
+            self.stormglass_url = stormglass_url
+        
+        # Client settings, max_workers caps how many requests are in flight against the provider at once
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        
+        # Every request goes through the transport, which keeps the Authorization header out of any recording
+        if transport is None:
+            transport = HttpTransport(pool_size=max_workers)
+        self.transport = transport
+        
+        # Quota reported by Stormglass in the meta block of each response, unknown until the first response
+        self.daily_quota = None
+        self.request_count = None
+        self.quota_lock = threading.Lock()
+        
+        # Optional on-disk cache so that hours already fetched for a point are not paid for again
+        self.cache = None if cache_dir is None else WeatherCache(cache_dir)
 
     def get_historical_weather_data(self, latitude, longitude, start_date, end_date):
         
@@ -50,16 +93,66 @@ class WeatherWrangler:
         start_time = arrow.get(start_date, "YYYY-MM-DD")
         end_time = arrow.get(end_date, "YYYY-MM-DD")
         
-        response = self.make_request(latitude, longitude, start_time, end_time)
-                     
-        parsed_response = self.parse_stormglass_response(response, self.HISTORICAL_PARAMETERS)
+        if self.cache is None:
+            response = self.make_request(latitude, longitude, start_time, end_time)
+                         
+            return self.parse_stormglass_response(response, self.HISTORICAL_PARAMETERS)
+        
+        # Requests are made for the rounded point so that what is fetched matches the cache key
+        latitude, longitude = self.cache.round_point(latitude, longitude)
         
-        return pd.DataFrame.from_records(parsed_response)
+        with self.cache.get_lock(latitude, longitude):
+            
+            # Only the hour ranges not already covered for this point are requested from Stormglass
+            for missing_start, missing_end in self.cache.get_missing_ranges(latitude, longitude, start_time, end_time):
+                logger.info(f"Fetching weather for ({latitude}, {longitude}) from {missing_start} to {missing_end}")
+                response = self.make_request(latitude, longitude, missing_start, missing_end)
+                weather_data = self.parse_stormglass_response(response, self.HISTORICAL_PARAMETERS)
+                self.cache.store(latitude, longitude, missing_start, missing_end, weather_data)
+            
+            return self.cache.load(latitude, longitude, start_time, end_time)
+
+    def get_historical_weather_data_batch(self, points):
+        
+        # Each point is a (latitude, longitude, start_date, end_date) tuple, for example one per cluster centre
+        points = list(points)
+        if not points:
+            return pl.DataFrame()
+        
+        # Only the requests the cache cannot answer count against the quota
+        remaining = self.get_remaining_quota()
+        if remaining is not None:
+            needed = sum(self.count_requests_needed(*point) for point in points)
+            if remaining < needed:
+                raise ValueError(f"Batch needs {needed} requests, which exceeds the remaining Stormglass quota of {remaining}")
+        
+        def fetch_point(point):
+            latitude, longitude, start_date, end_date = point
+            weather_data = self.get_historical_weather_data(latitude, longitude, start_date, end_date)
+            return weather_data.with_columns([
+                pl.lit(latitude, dtype=pl.Float64).alias("latitude"),
+                pl.lit(longitude, dtype=pl.Float64).alias("longitude"),
+            ])
+        
+        # The pool size is the concurrency cap, results come back in the same order as the points
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(points))) as executor:
+            frames = list(executor.map(fetch_point, points))
+        
+        return pl.concat(frames, how="diagonal_relaxed")
+
+    def count_requests_needed(self, latitude, longitude, start_date, end_date):
+        if self.cache is None:
+            return 1
+        
+        # One request per range of hours not yet covered for the rounded point, as get_historical_weather_data makes them
+        latitude, longitude = self.cache.round_point(latitude, longitude)
+        return len(self.cache.get_missing_ranges(
+            latitude, longitude, arrow.get(start_date, "YYYY-MM-DD"), arrow.get(end_date, "YYYY-MM-DD")
+        ))
 
     def make_request(self, latitude, longitude, start_time, end_time):
         
-        response = requests.get(
-            "https://api.stormglass.io/v2/weather/point",
+        return self.request_weather_point(
             params={
                 "lat": latitude,
                 "lng": longitude,
@@ -71,38 +164,115 @@ class WeatherWrangler:
                     "UTC"
                 ).timestamp(),  # Convert to UTC timestamp
             },
-            headers={"Authorization": self.api_key},
         )
 
-        # Do something with response data.
-        json_data = response.json()
+    def get_remaining_quota(self):
+        with self.quota_lock:
+            if self.daily_quota is None or self.request_count is None:
+                return None
+            return self.daily_quota - self.request_count
 
-        return json_data
+    def update_quota(self, json_data):
+        meta = json_data.get("meta", {})
+        with self.quota_lock:
+            if "dailyQuota" in meta:
+                self.daily_quota = meta["dailyQuota"]
+            if "requestCount" in meta:
+                self.request_count = meta["requestCount"]
+
+    def request_weather_point(self, params):
+        
+        for attempt in range(self.max_retries + 1):
+            
+            remaining = self.get_remaining_quota()
+            if remaining is not None and remaining <= 0:
+                raise Exception(f"Stormglass daily quota of {self.daily_quota} requests has been used")
+            
+            # Connection failures and timeouts are retried with the same back off as server errors
+            try:
+                response = self.transport.get(
+                    self.stormglass_url,
+                    params=params,
+                    headers={"Authorization": self.api_key},
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as exception:
+                error = str(exception)
+                if attempt == self.max_retries:
+                    break
+                delay = 2 ** attempt
+                logger.warning(f"Stormglass request failed ({error}), retrying in {delay} seconds")
+                time.sleep(delay)
+                continue
+            
+            if response.status_code == 200:
+                json_data = response.json()
+                self.update_quota(json_data)
+                return json_data
+            
+            error = f"{response.status_code} - {response.text}"
+            
+            # Back off on rate limiting and server errors, honouring Retry-After when the provider sends it
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == self.max_retries:
+                    break
+                delay = self.get_retry_delay(response.headers.get("Retry-After"), 2 ** attempt)
+                logger.warning(f"Stormglass returned {response.status_code}, retrying in {delay} seconds")
+                time.sleep(delay)
+                continue
+            
+            break
+        
+        raise Exception(f"Failed to get weather data: {error}")
 
+    def get_retry_delay(self, retry_after, default):
+        
+        # Retry-After is either a number of seconds or an HTTP date
+        if retry_after is None:
+            return default
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            logger.warning(f"Ignoring unreadable Retry-After header: {retry_after}")
+            return default
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
 
     def parse_stormglass_response(self, response, parameters):
 
-        stormglass_metrics = []
+        hours = response["hours"]
 
-        for hour in response["hours"]:
-
-            hour_metrics = {}
-            
-            hour_metrics["time"] = datetime.datetime.strptime(
-                hour["time"], "%Y-%m-%dT%H:%M:%S+00:00"
+        # No hours means no frame to build from, so return the declared columns with no rows
+        if not hours:
+            return pl.DataFrame(
+                schema={"time": pl.Datetime("us"), **{key: pl.Float64 for key in parameters}, "timestamp": pl.Datetime("us")}
             )
 
-            for key in parameters:
+        # Build the frame column-wise, each parameter arrives as a struct of values keyed by source
+        stormglass_metrics = pl.DataFrame(hours, infer_schema_length=None)
 
-                if key in hour:
-                    hour_metrics[key] = hour[key]["sg"]
-                else:
-                    raise ValueError("Key %s is missing from the ")
+        # Every hour must carry every parameter, report which ones are missing and for how many hours
+        missing = {
+            key: len(hours) if key not in stormglass_metrics.columns else stormglass_metrics[key].null_count()
+            for key in parameters
+        }
+        missing = {key: count for key, count in missing.items() if count > 0}
+        if missing:
+            details = ", ".join(f"{key} ({count} of {len(hours)} hours)" for key, count in missing.items())
+            raise ValueError(f"Stormglass response is missing parameters: {details}")
 
-            hour_metrics["timestamp"] = datetime.datetime.now()
-            stormglass_metrics.append(hour_metrics)
-
-        return stormglass_metrics
+        # Parse all timestamps in one cast and stamp the ingestion time once for the whole batch
+        return stormglass_metrics.select(
+            [pl.col("time").str.strptime(pl.Datetime("us"), "%Y-%m-%dT%H:%M:%S+00:00")]
+            + [pl.col(key).struct.field("sg").cast(pl.Float64).alias(key) for key in parameters]
+        ).with_columns(
+            pl.lit(datetime.datetime.now()).alias("timestamp")
+        )
 
     def get_weather_forecast(self, latitude, longitude, hours_in_future):
 
@@ -112,8 +282,7 @@ class WeatherWrangler:
 
     def get_weather_forecast_between_times(self, latitude, longitude, start_time, end_time):
 
-        response = requests.get(
-            "https://api.stormglass.io/v2/weather/point",
+        return self.request_weather_point(
             params={
                 "lat": latitude,
                 "lng": longitude,
@@ -126,11 +295,4 @@ class WeatherWrangler:
                 ).timestamp(),  # Convert to UTC timestamp
                 "source": "sg",
             },
-            headers={"Authorization": self.api_key},
         )
-
-        # Do something with response data.
-        json_data = response.json()
-
-        return json_data
-
@@ -0,0 +1,3 @@
+from .generation_fusion import GenerationFusion # noqa: F401
+from .wind_lull_analyser import WindLullAnalyser # noqa: F401
+from .wind_scenario_simulator import WindScenarioSimulator # noqa: F401
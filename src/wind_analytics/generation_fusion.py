@@ -0,0 +1,149 @@
+import polars as pl
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationFusion:
+
+    def __init__(self, fuels=('Wind',), weather_tolerance='1h'):
+        # Fuels kept from the generation data, and how far back a weather observation may be carried forward
+        self.fuels = list(fuels)
+        self.weather_tolerance = weather_tolerance
+
+    def to_utc_datetime(self, frame, column):
+
+        # Work in naive UTC throughout, which is what the weather data uses
+        dtype = frame.collect_schema()[column]
+        if dtype == pl.String:
+            return frame.with_columns(pl.col(column).str.strptime(pl.Datetime('us'), '%Y-%m-%dT%H:%M:%SZ'))
+        if dtype == pl.Date:
+            return frame.with_columns(pl.col(column).cast(pl.Datetime('us')))
+        if isinstance(dtype, pl.Datetime) and dtype.time_zone is not None:
+            return frame.with_columns(pl.col(column).dt.convert_time_zone('UTC').dt.replace_time_zone(None).cast(pl.Datetime('us')))
+        return frame.with_columns(pl.col(column).cast(pl.Datetime('us')))
+
+    def align_generation_to_settlement_periods(self, generation_data):
+
+        # Average the 5 minute FUELINST readings into half hourly settlement periods
+        generation_data = self.to_utc_datetime(generation_data.lazy(), 'startTime')
+
+        return (
+            generation_data
+            .filter(pl.col('name').is_in(self.fuels))
+            .group_by(pl.col('startTime').dt.truncate('30m').alias('time'), 'name')
+            .agg(
+                pl.col('settlementDate').first(),
+                pl.col('settlementPeriod').first(),
+                pl.col('generation').mean().alias('generation_mw'),
+                pl.col('total_generation').mean().alias('total_generation_mw'),
+            )
+            .sort('time')
+        )
+
+    def prepare_installed_capacity(self, cumulative_installed_capacity):
+
+        # Daily capacity becomes a step function that an as-of join can look up at any time
+        return (
+            self.to_utc_datetime(cumulative_installed_capacity.lazy(), 'date')
+            .select(pl.col('date').alias('time'), 'cumulative_installed_capacity_mw')
+            .drop_nulls()
+            .sort('time')
+        )
+
+    def get_cluster_capacity(self, renewable_locations):
+        return renewable_locations.lazy().group_by('cluster').agg(
+            pl.col('installed_capacity_mw').sum().alias('cluster_capacity_mw')
+        )
+
+    def get_cluster_centers(self, renewable_locations):
+        # The same centres RenewableLocationsWrangler.get_cluster_centers gives, which is where the weather is fetched for
+        return renewable_locations.lazy().group_by('cluster').agg(
+            pl.col('latitude').mean(),
+            pl.col('longitude').mean(),
+        )
+
+    def label_weather_with_clusters(self, weather_data, cluster_centers):
+
+        # Weather fetched for the cluster centres carries their coordinates, but the weather cache rounds them, so each
+        # weather point takes the cluster whose centre is nearest, with longitude scaled to distance at that latitude
+        points = weather_data.lazy().select('latitude', 'longitude').unique()
+        nearest = (
+            points
+            .join(
+                cluster_centers.lazy().select(
+                    'cluster', pl.col('latitude').alias('center_latitude'), pl.col('longitude').alias('center_longitude')
+                ),
+                how='cross',
+            )
+            .with_columns(
+                (
+                    (pl.col('latitude') - pl.col('center_latitude')) ** 2
+                    + ((pl.col('longitude') - pl.col('center_longitude')) * pl.col('latitude').radians().cos()) ** 2
+                ).alias('distance')
+            )
+            .sort('distance')
+            .group_by('latitude', 'longitude')
+            .agg(pl.col('cluster').first())
+        )
+
+        return weather_data.lazy().join(nearest, on=['latitude', 'longitude'], how='inner')
+
+    def weight_weather_by_capacity(self, weather_data, renewable_locations):
+
+        # Each cluster's wind speed counts in proportion to the installed capacity it represents
+        weather_data = self.to_utc_datetime(weather_data.lazy(), 'time')
+
+        return (
+            weather_data
+            .join(self.get_cluster_capacity(renewable_locations), on='cluster', how='inner')
+            .group_by('time')
+            .agg(
+                ((pl.col('windSpeed') * pl.col('cluster_capacity_mw')).sum() / pl.col('cluster_capacity_mw').sum())
+                .alias('capacity_weighted_wind_speed'),
+                pl.col('cluster_capacity_mw').sum().alias('weather_capacity_mw'),
+            )
+            .sort('time')
+        )
+
+    def fuse(self, generation_data, cumulative_installed_capacity, weather_data=None, renewable_locations=None, cluster_centers=None):
+
+        # Everything stays lazy so the plan can be collected in streaming batches or sunk straight to disk
+        fused = self.align_generation_to_settlement_periods(generation_data).join_asof(
+            self.prepare_installed_capacity(cumulative_installed_capacity),
+            on='time',
+            strategy='backward',
+        )
+
+        fused = fused.with_columns(
+            (pl.col('generation_mw') / pl.col('cumulative_installed_capacity_mw')).alias('capacity_factor')
+        )
+
+        if weather_data is not None:
+            if renewable_locations is None:
+                raise ValueError("renewable_locations with cluster labels are needed to weight the weather data")
+
+            # Weather straight from get_historical_weather_data_batch only has coordinates, so label it with its cluster
+            if 'cluster' not in weather_data.collect_schema().names():
+                if cluster_centers is None:
+                    cluster_centers = self.get_cluster_centers(renewable_locations)
+                weather_data = self.label_weather_with_clusters(weather_data, cluster_centers)
+
+            fused = fused.join_asof(
+                self.weight_weather_by_capacity(weather_data, renewable_locations),
+                on='time',
+                strategy='backward',
+                tolerance=self.weather_tolerance,
+            )
+
+        return fused
+
+    def collect(self, generation_data, cumulative_installed_capacity, weather_data=None, renewable_locations=None, cluster_centers=None):
+        return self.fuse(generation_data, cumulative_installed_capacity, weather_data, renewable_locations, cluster_centers) \
+            .collect(engine='streaming')
+
+    def sink_parquet(self, path, generation_data, cumulative_installed_capacity, weather_data=None, renewable_locations=None, cluster_centers=None):
+        # Writes the fused frame without holding it in memory, for multi-year ranges
+        logger.info(f"Writing fused generation, capacity and weather data to {path}")
+        self.fuse(generation_data, cumulative_installed_capacity, weather_data, renewable_locations, cluster_centers).sink_parquet(path)
@@ -0,0 +1,276 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import polars as pl
+
+import logging
+
+from .generation_fusion import GenerationFusion
+
+logger = logging.getLogger(__name__)
+
+# Meteorological seasons, keyed by month number
+SEASONS = {
+    12: 'Winter', 1: 'Winter', 2: 'Winter',
+    3: 'Spring', 4: 'Spring', 5: 'Spring',
+    6: 'Summer', 7: 'Summer', 8: 'Summer',
+    9: 'Autumn', 10: 'Autumn', 11: 'Autumn',
+}
+SEASON_ENUM = pl.Enum(['Winter', 'Spring', 'Summer', 'Autumn'])
+
+SCENARIO_KEYS = ['threshold', 'capacity_scale']
+
+
+# The functions below run in worker processes, so they live at module level where a spawned process can import them
+
+def find_runs(series, threshold, resolution):
+
+    # Run-length encode the sorted series: a run breaks where the value crosses the threshold or a reading is missing
+    return (
+        series.lazy()
+        .with_columns((pl.col('value') < threshold).alias('below'))
+        .with_columns(
+            (
+                (pl.col('below') != pl.col('below').shift())
+                | (pl.col('time') != pl.col('time').shift().dt.offset_by(resolution))
+            )
+            .fill_null(True)
+            .cum_sum()
+            .alias('run')
+        )
+        .filter(pl.col('below'))
+        .group_by('run')
+        .agg(
+            pl.col('time').min().alias('start'),
+            pl.col('time').max().dt.offset_by(resolution).alias('end'),
+            pl.len().alias('periods'),
+            pl.col('value').sum().alias('value_sum'),
+            pl.col('value').min().alias('value_min'),
+        )
+        .drop('run')
+        .collect()
+    )
+
+
+def find_runs_in_partition(series, scenarios, resolution):
+
+    # Scaling the output by capacity_scale and comparing with threshold is the same as comparing the unscaled value
+    # with threshold / capacity_scale, so every scenario is one pass over the same partition
+    return pl.concat(
+        [
+            find_runs(series, threshold / capacity_scale, resolution).with_columns(
+                pl.lit(threshold, dtype=pl.Float64).alias('threshold'),
+                pl.lit(capacity_scale, dtype=pl.Float64).alias('capacity_scale'),
+                pl.col('value_sum') * capacity_scale,
+                pl.col('value_min') * capacity_scale,
+            )
+            for threshold, capacity_scale in scenarios
+        ],
+        how='vertical_relaxed',
+    )
+
+
+def stitch_runs(runs):
+
+    # Partitions are cut at year boundaries, so a run that ends exactly where the next one starts is the same lull
+    return (
+        runs
+        .sort(SCENARIO_KEYS + ['start'])
+        .with_columns(
+            (pl.col('start') != pl.col('end').shift().over(SCENARIO_KEYS))
+            .fill_null(True)
+            .cum_sum()
+            .alias('lull')
+        )
+        .group_by(SCENARIO_KEYS + ['lull'])
+        .agg(
+            pl.col('start').min(),
+            pl.col('end').max(),
+            pl.col('periods').sum(),
+            pl.col('value_sum').sum(),
+            pl.col('value_min').min(),
+        )
+        .drop('lull')
+    )
+
+
+class WindLullAnalyser:
+
+    def __init__(self, threshold=0.1, metric='capacity_factor', resolution='5m', min_duration=None, max_workers=None):
+        if metric not in ('capacity_factor', 'demand_share'):
+            raise ValueError("metric must be 'capacity_factor' or 'demand_share'")
+
+        # A lull is a run of readings where the metric stays below threshold, at the FUELINST resolution
+        self.threshold = threshold
+        self.metric = metric
+        self.resolution = resolution
+
+        # Optional shortest lull worth reporting, for example '2h', applied after runs are stitched across partitions
+        self.min_duration = min_duration
+
+        # Year partitions are spread over this many processes, 1 runs everything in this process
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+
+        reference = datetime(2000, 1, 1)
+        self.resolution_hours = pl.select(
+            (pl.lit(reference).dt.offset_by(resolution) - pl.lit(reference)).dt.total_seconds()
+        ).item() / 3600
+
+    def compute_wind_series(self, generation_data, cumulative_installed_capacity):
+
+        fusion = GenerationFusion()
+
+        # One wind reading per start time, revisions published for the same period are averaged
+        wind = (
+            fusion.to_utc_datetime(generation_data.lazy(), 'startTime')
+            .filter(pl.col('name') == 'Wind')
+            .group_by(pl.col('startTime').alias('time'))
+            .agg(
+                pl.col('generation').mean().alias('generation_mw'),
+                pl.col('total_generation').mean().alias('total_generation_mw'),
+            )
+            .sort('time')
+        )
+
+        # Capacity factor against the fleet installed at the time, and wind's share of total generation
+        return (
+            wind
+            .join_asof(fusion.prepare_installed_capacity(cumulative_installed_capacity), on='time', strategy='backward')
+            .with_columns(
+                (pl.col('generation_mw') / pl.col('cumulative_installed_capacity_mw')).alias('capacity_factor'),
+                (pl.col('generation_mw') / pl.col('total_generation_mw')).alias('demand_share'),
+            )
+            .collect()
+        )
+
+    def partition_by_year(self, wind_series):
+        return (
+            wind_series
+            .select('time', pl.col(self.metric).alias('value'))
+            .drop_nulls()
+            .sort('time')
+            .with_columns(pl.col('time').dt.year().alias('year'))
+            .partition_by('year', include_key=False, maintain_order=True)
+        )
+
+    def find_runs_by_year(self, wind_series, scenarios):
+
+        partitions = self.partition_by_year(wind_series)
+
+        if not partitions:
+            return find_runs_in_partition(
+                pl.DataFrame(schema={'time': pl.Datetime('us'), 'value': pl.Float64}), scenarios, self.resolution
+            )
+
+        # Polars is not fork safe, so worker processes are spawned and import this module afresh
+        if self.max_workers <= 1 or len(partitions) == 1:
+            runs = [find_runs_in_partition(partition, scenarios, self.resolution) for partition in partitions]
+        else:
+            logger.info(f"Finding lulls in {len(partitions)} yearly partitions for {len(scenarios)} scenarios")
+            with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                runs = list(executor.map(
+                    find_runs_in_partition,
+                    partitions,
+                    [scenarios] * len(partitions),
+                    [self.resolution] * len(partitions),
+                ))
+
+        return pl.concat(runs, how='vertical_relaxed')
+
+    def find_lulls(self, wind_series, threshold=None, capacity_scale=1.0):
+        threshold = self.threshold if threshold is None else threshold
+        return self.scan(wind_series, thresholds=[threshold], capacity_scales=[capacity_scale])
+
+    def scan(self, wind_series, thresholds, capacity_scales=(1.0,)):
+
+        # Every combination of threshold and capacity scale is a what-if scenario
+        scenarios = [(float(threshold), float(capacity_scale)) for threshold in thresholds for capacity_scale in capacity_scales]
+
+        # A bigger or smaller fleet has the same capacity factor, only wind's share of demand scales with it
+        if self.metric == 'capacity_factor' and any(capacity_scale != 1 for _, capacity_scale in scenarios):
+            raise ValueError("capacity_scale only applies to metric='demand_share', the capacity factor does not change with fleet size")
+
+        lulls = stitch_runs(self.find_runs_by_year(wind_series, scenarios)).with_columns(
+            ((pl.col('end') - pl.col('start')).dt.total_seconds() / 3600).alias('duration_hours'),
+            (pl.col('value_sum') / pl.col('periods')).alias(f'mean_{self.metric}'),
+            pl.col('value_min').alias(f'min_{self.metric}'),
+        )
+
+        if self.min_duration is not None:
+            lulls = lulls.filter(pl.col('end') >= pl.col('start').dt.offset_by(self.min_duration))
+
+        return (
+            lulls
+            .select(SCENARIO_KEYS + ['start', 'end', 'periods', 'duration_hours', f'mean_{self.metric}', f'min_{self.metric}'])
+            .sort(SCENARIO_KEYS + ['start'])
+        )
+
+    def add_period(self, frame, column, by):
+        if by == 'month':
+            return frame.with_columns(pl.col(column).dt.month().alias('month'))
+        if by == 'season':
+            return frame.with_columns(
+                pl.col(column).dt.month().replace_strict(SEASONS, return_dtype=SEASON_ENUM).alias('season')
+            )
+        raise ValueError("by must be 'month' or 'season'")
+
+    def summarise(self, lulls, wind_series, by='month'):
+
+        # Lulls count towards the month or season they start in
+        statistics = (
+            self.add_period(lulls, 'start', by)
+            .group_by(SCENARIO_KEYS + [by])
+            .agg(
+                pl.len().alias('lull_count'),
+                pl.col('duration_hours').sum().alias('lull_hours'),
+                pl.col('duration_hours').mean().alias('mean_duration_hours'),
+                pl.col('duration_hours').median().alias('median_duration_hours'),
+                pl.col('duration_hours').quantile(0.9).alias('p90_duration_hours'),
+                pl.col('duration_hours').max().alias('max_duration_hours'),
+            )
+        )
+
+        # Frequencies are per year of observed data, and lull hours are a share of the hours actually observed
+        observed = (
+            self.add_period(wind_series.select('time').drop_nulls(), 'time', by)
+            .group_by(by)
+            .agg(
+                pl.col('time').dt.year().n_unique().alias('years_observed'),
+                (pl.len() * self.resolution_hours).alias('observed_hours'),
+            )
+        )
+
+        return (
+            statistics
+            .join(observed, on=by, how='left')
+            .with_columns(
+                (pl.col('lull_count') / pl.col('years_observed')).alias('lulls_per_year'),
+                (pl.col('lull_hours') / pl.col('observed_hours')).alias('lull_hours_fraction'),
+            )
+            .sort(SCENARIO_KEYS + [by])
+        )
+
+    def summarise_scan(self, lulls, wind_series):
+
+        # One row per scenario, so thresholds and capacity scales can be compared directly
+        observed_hours = wind_series.select(pl.col('time').drop_nulls().len()).item() * self.resolution_hours
+        years_observed = observed_hours / (365.25 * 24)
+
+        return (
+            lulls
+            .group_by(SCENARIO_KEYS)
+            .agg(
+                pl.len().alias('lull_count'),
+                pl.col('duration_hours').sum().alias('lull_hours'),
+                pl.col('duration_hours').mean().alias('mean_duration_hours'),
+                pl.col('duration_hours').quantile(0.9).alias('p90_duration_hours'),
+                pl.col('duration_hours').max().alias('max_duration_hours'),
+            )
+            .with_columns(
+                (pl.col('lull_count') / years_observed).alias('lulls_per_year'),
+                (pl.col('lull_hours') / observed_hours).alias('lull_hours_fraction'),
+            )
+            .sort(SCENARIO_KEYS)
+        )
@@ -0,0 +1,237 @@
+import math
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+import logging
+
+from .wind_lull_analyser import WindLullAnalyser
+
+logger = logging.getLogger(__name__)
+
+
+class WindScenarioSimulator:
+
+    # Columns of the results, one row per scenario
+    results_schema = {
+        'capacity_mw': pl.Float64,
+        'storage_mwh': pl.Float64,
+        'demand_mwh': pl.Float64,
+        'wind_mwh': pl.Float64,
+        'unserved_energy_mwh': pl.Float64,
+        'unserved_energy_fraction': pl.Float64,
+        'shortfall_periods': pl.Int64,
+        'shortfall_hours': pl.Float64,
+        'shortfall_fraction': pl.Float64,
+        'curtailed_energy_mwh': pl.Float64,
+        'curtailed_energy_fraction': pl.Float64,
+        'min_state_of_charge': pl.Float64,
+        'final_state_of_charge': pl.Float64,
+    }
+
+    def __init__(self, round_trip_efficiency=0.8, initial_state_of_charge=1.0, resolution='5m', max_elements=2**20):
+        if not 0 < round_trip_efficiency <= 1:
+            raise ValueError("round_trip_efficiency must be greater than 0 and at most 1")
+        if not 0 <= initial_state_of_charge <= 1:
+            raise ValueError("initial_state_of_charge must be between 0 and 1")
+
+        # Charging loses the round trip, so a MWh of surplus stores round_trip_efficiency MWh and a stored MWh serves a MWh
+        self.round_trip_efficiency = round_trip_efficiency
+
+        # Storage starts this full, as a fraction of its size
+        self.initial_state_of_charge = initial_state_of_charge
+
+        # Readings are assumed to be this far apart, which turns MW into MWh per reading
+        self.resolution = resolution
+        reference = datetime(2000, 1, 1)
+        self.resolution_hours = pl.select(
+            (pl.lit(reference).dt.offset_by(resolution) - pl.lit(reference)).dt.total_seconds()
+        ).item() / 3600
+
+        # Largest readings x scenarios matrix held at once, which bounds memory however long the series or large the sweep
+        self.max_elements = max_elements
+
+    def compute_wind_series(self, generation_data, cumulative_installed_capacity):
+        # The same capacity factor and demand series the lull analysis works from
+        return WindLullAnalyser(resolution=self.resolution).compute_wind_series(generation_data, cumulative_installed_capacity)
+
+    def build_scenarios(self, capacities_mw, storage_mwh):
+        # Every combination of installed wind capacity and storage size
+        return pl.DataFrame(
+            {'capacity_mw': [float(capacity) for capacity in capacities_mw]},
+        ).join(
+            pl.DataFrame({'storage_mwh': [float(storage) for storage in storage_mwh]}),
+            how='cross',
+        )
+
+    def prepare_series(self, wind_series):
+
+        # Readings missing either side cannot be simulated, the remaining readings are taken as consecutive
+        series = (
+            wind_series
+            .select('time', 'capacity_factor', 'total_generation_mw')
+            .drop_nulls()
+            .sort('time')
+        )
+
+        return (
+            series['capacity_factor'].to_numpy().astype(np.float64),
+            series['total_generation_mw'].to_numpy().astype(np.float64),
+        )
+
+    def compute_net_flows(self, capacity_factor, demand_mw, capacities_mw, out):
+
+        # Surplus energy each reading, positive when scaled wind exceeds demand, as a readings x scenarios matrix
+        flows = np.multiply.outer(capacity_factor, capacities_mw, out=out)
+        flows -= demand_mw[:, None]
+        flows *= self.resolution_hours
+
+        # What storage would take in or give out if it were never full or empty
+        np.multiply(flows, self.round_trip_efficiency, out=flows, where=flows > 0)
+
+        return flows
+
+    def compose_block_maps(self, flows, storage_mwh):
+
+        # Each reading maps the state of charge s to clip(s + flow, 0, storage), and any run of these maps composes
+        # to clip(s + shift, low, high), where shift is just the running sum of the flows
+        blocks, block_length, scenarios = flows.shape
+        shifts = np.cumsum(flows, axis=1)
+
+        # The bounds are built for every block together, one reading at a time
+        low = np.full((blocks, scenarios), -np.inf)
+        high = np.full((blocks, scenarios), np.inf)
+        lows = np.empty_like(flows)
+        highs = np.empty_like(flows)
+
+        for position in range(block_length):
+            flow = flows[:, position]
+            for bound, bounds in ((low, lows), (high, highs)):
+                bound += flow
+                np.maximum(bound, 0, out=bound)
+                np.minimum(bound, storage_mwh, out=bound)
+                bounds[:, position] = bound
+
+        return shifts, lows, highs
+
+    def scan_state_of_charge(self, flows, storage_mwh, state):
+
+        # Readings are cut into roughly square blocks, so both the loop within blocks and the loop across them stay short
+        readings, scenarios = flows.shape
+        block_length = max(1, math.isqrt(readings))
+        blocks = -(-readings // block_length)
+
+        # Padding with zero flow leaves the state of charge unchanged
+        padded = np.zeros((blocks * block_length, scenarios))
+        padded[:readings] = flows
+        shifts, lows, highs = self.compose_block_maps(padded.reshape(blocks, block_length, scenarios), storage_mwh)
+        del padded
+
+        # The state entering each block comes from applying the whole maps of the blocks before it
+        block_states = np.empty((blocks, scenarios))
+        for block in range(blocks):
+            block_states[block] = state
+            state = np.clip(state + shifts[block, -1], lows[block, -1], highs[block, -1])
+
+        # Then every reading's state of charge is its prefix map applied to the state entering its block
+        states = shifts
+        states += block_states[:, None, :]
+        np.maximum(states, lows, out=states)
+        np.minimum(states, highs, out=states)
+        states = states.reshape(-1, scenarios)[:readings]
+
+        return states, state
+
+    def simulate_chunk(self, capacity_factor, demand_mw, capacities_mw, storage_mwh, state, buffer):
+
+        flows = self.compute_net_flows(capacity_factor, demand_mw, capacities_mw, buffer[:len(demand_mw)])
+        states, final_state = self.scan_state_of_charge(flows, storage_mwh, state)
+
+        # Whatever the storage could not absorb is curtailed, and whatever it could not supply is unserved
+        residual = flows
+        residual[0] -= states[0] - state
+        residual[1:] -= states[1:]
+        residual[1:] += states[:-1]
+
+        return {
+            'unserved_energy_mwh': -np.minimum(residual, 0).sum(axis=0),
+            'shortfall_periods': (residual < -1e-9).sum(axis=0),
+            'curtailed_energy_mwh': np.maximum(residual, 0).sum(axis=0) / self.round_trip_efficiency,
+            'min_state_mwh': states.min(axis=0),
+        }, final_state
+
+    def simulate(self, wind_series, scenarios):
+
+        capacity_factor, demand_mw = self.prepare_series(wind_series)
+        capacities_mw = scenarios['capacity_mw'].cast(pl.Float64).to_numpy()
+        storage_mwh = scenarios['storage_mwh'].cast(pl.Float64).to_numpy()
+
+        if (storage_mwh < 0).any():
+            raise ValueError("storage_mwh must not be negative")
+
+        # The series is walked in chunks of readings, carrying the state of charge from one chunk to the next
+        chunk_length = max(1, self.max_elements // max(1, len(scenarios)))
+        state = storage_mwh * self.initial_state_of_charge
+        buffer = np.empty((min(chunk_length, len(demand_mw)), len(scenarios)))
+        totals = {
+            'wind_mwh': capacity_factor.sum() * capacities_mw * self.resolution_hours,
+            'unserved_energy_mwh': np.zeros(len(scenarios)),
+            'shortfall_periods': np.zeros(len(scenarios), dtype=np.int64),
+            'curtailed_energy_mwh': np.zeros(len(scenarios)),
+            'min_state_mwh': state.copy(),
+        }
+
+        logger.info(f"Simulating {len(scenarios)} scenarios over {len(demand_mw)} readings in chunks of {chunk_length}")
+        for start in range(0, len(demand_mw), chunk_length):
+            chunk, state = self.simulate_chunk(
+                capacity_factor[start:start + chunk_length],
+                demand_mw[start:start + chunk_length],
+                capacities_mw,
+                storage_mwh,
+                state,
+                buffer,
+            )
+            for key in ('unserved_energy_mwh', 'shortfall_periods', 'curtailed_energy_mwh'):
+                totals[key] += chunk[key]
+            np.minimum(totals['min_state_mwh'], chunk['min_state_mwh'], out=totals['min_state_mwh'])
+
+        return self.summarise(scenarios, totals, state, demand_mw)
+
+    def simulate_grid(self, wind_series, capacities_mw, storage_mwh):
+        return self.simulate(wind_series, self.build_scenarios(capacities_mw, storage_mwh))
+
+    def summarise(self, scenarios, totals, final_state, demand_mw):
+
+        demand_mwh = float(demand_mw.sum() * self.resolution_hours)
+        readings = len(demand_mw)
+
+        # Storage with no capacity is never short of charge
+        with np.errstate(divide='ignore', invalid='ignore'):
+            storage_mwh = scenarios['storage_mwh'].cast(pl.Float64).to_numpy()
+            min_state_of_charge = np.where(storage_mwh > 0, totals['min_state_mwh'] / storage_mwh, np.nan)
+            final_state_of_charge = np.where(storage_mwh > 0, final_state / storage_mwh, np.nan)
+
+        return pl.DataFrame(
+            {
+                'capacity_mw': scenarios['capacity_mw'].cast(pl.Float64),
+                'storage_mwh': scenarios['storage_mwh'].cast(pl.Float64),
+                'demand_mwh': np.full(len(scenarios), demand_mwh),
+                'wind_mwh': totals['wind_mwh'],
+                'unserved_energy_mwh': totals['unserved_energy_mwh'],
+                'unserved_energy_fraction': totals['unserved_energy_mwh'] / demand_mwh if demand_mwh else np.nan,
+                'shortfall_periods': totals['shortfall_periods'],
+                'shortfall_hours': totals['shortfall_periods'] * self.resolution_hours,
+                'shortfall_fraction': totals['shortfall_periods'] / readings if readings else np.nan,
+                'curtailed_energy_mwh': totals['curtailed_energy_mwh'],
+                'curtailed_energy_fraction': np.where(
+                    totals['wind_mwh'] > 0, totals['curtailed_energy_mwh'] / np.maximum(totals['wind_mwh'], 1e-12), np.nan
+                ),
+                'min_state_of_charge': min_state_of_charge,
+                'final_state_of_charge': final_state_of_charge,
+            },
+            schema=self.results_schema,
+        ).with_columns(
+            # A scenario is sufficient when wind and storage together never left demand unserved
+            (pl.col('shortfall_periods') == 0).alias('sufficient'),
+        )
@@ -0,0 +1,61 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from polars.testing import assert_frame_equal
+
+from http_transport import HttpTransport, StubServer
+from renewable_locations_wrangler import RenewableLocationsWrangler
+
+# The app is run from its own directory, so its modules are imported the same way here
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from data_layer import EnergySecurityData  # noqa: E402
+
+# The small REPD spreadsheet recorded by benchmarks/make_fixtures.py, served as it is from its cassette body
+BENCHMARK_CASSETTES = HttpTransport("replay", Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures" / "cassettes")
+_, REPD_XLSX = BENCHMARK_CASSETTES.get_cassette_paths(
+    BENCHMARK_CASSETTES.get_request_key("GET", RenewableLocationsWrangler().gov_uk_url)
+)
+
+END_DATE = "2024-01-15"
+
+
+class TestEnergySecurityData(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cassette_dir = Path(self.directory.name) / "cassettes"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_replay_returns_the_recorded_snapshot(self):
+
+        with StubServer(repd_path=REPD_XLSX) as stub:
+            recorded = EnergySecurityData(
+                history_days=3,
+                end_date=END_DATE,
+                transport=HttpTransport("record", self.cassette_dir, base_urls=stub.base_urls),
+            ).get_snapshot()
+
+        # The stub is stopped, so anything not answered from the cassettes fails
+        replayed = EnergySecurityData(
+            history_days=3, end_date=END_DATE, http_mode="replay", cassette_dir=self.cassette_dir
+        ).get_snapshot()
+
+        for name in ("generation_data", "aggregated_generation_data", "renewable_locations", "cumulative_installed_capacity"):
+            with self.subTest(frame=name):
+                self.assertGreater(recorded[name].height, 0)
+                # The aggregation is a group_by, which does not keep its rows in any particular order
+                assert_frame_equal(recorded[name], replayed[name], check_row_order=False)
+
+    def test_record_and_replay_need_an_end_date(self):
+        for mode in ("record", "replay"):
+            with self.subTest(mode=mode), self.assertRaises(ValueError):
+                EnergySecurityData(http_mode=mode, cassette_dir=self.cassette_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from historic_generation_wrangler import GenerationRollups
+
+
+def make_generation_data(days, seed=0):
+
+    # 288 readings a day for two fuels, with a spread of values and some zeros so every bucket type is used
+    generator = np.random.default_rng(seed)
+    frames = []
+    for day in range(days):
+        for group, name, typical in (('Renewable', 'Wind', 8000.0), ('Fossil', 'CCGT', 9000.0)):
+            generation = np.round(generator.gamma(2.0, typical / 2, 288))
+            generation[::50] = 0
+            frames.append(pl.DataFrame({
+                'settlementDate': [date(2024, 1, 29) + timedelta(days=day)] * 288,
+                'group': group,
+                'name': name,
+                'generation': generation,
+                'percentage_of_total_generation': generation / 300.0,
+            }))
+    return pl.concat(frames)
+
+
+class TestGenerationRollups(unittest.TestCase):
+
+    def setUp(self):
+        # Ten days across the end of January, so the weekly and monthly grains each span two periods
+        self.generation_data = make_generation_data(10)
+
+    def assert_rollups_equal(self, left, right):
+        for grain in GenerationRollups.GRAINS:
+            with self.subTest(grain=grain):
+                assert_frame_equal(left.get_rollup(grain), right.get_rollup(grain))
+        assert_frame_equal(
+            left.daily_sketches.sort(pl.all()), right.daily_sketches.sort(pl.all()), check_dtypes=False
+        )
+
+    def test_batches_merge_to_the_same_rollups_as_one_update(self):
+
+        whole = GenerationRollups().update(self.generation_data)
+
+        # Batches that split days and arrive out of order, as overlapping store updates would pass them in
+        batches = GenerationRollups()
+        rows = self.generation_data.with_row_index()
+        for batch in (rows.filter(pl.col('index') % 3 == 2), rows.filter(pl.col('index') % 3 != 2)):
+            batches.update(batch.drop('index'))
+
+        self.assert_rollups_equal(whole, batches)
+
+    def test_medians_are_within_the_relative_accuracy(self):
+
+        rollups = GenerationRollups(relative_accuracy=0.01).update(self.generation_data)
+
+        exact = self.generation_data.group_by('settlementDate', 'group', 'name').agg(
+            pl.col('generation').sort().gather((pl.len() - 1) // 2).first().alias('exact_median')
+        )
+        daily = rollups.get_rollup('daily').join(exact, on=['settlementDate', 'group', 'name'])
+
+        for row in daily.iter_rows(named=True):
+            self.assertLessEqual(abs(row['median_generation'] - row['exact_median']), 0.01 * row['exact_median'] + 1e-9)
+            self.assertTrue(row['min_generation'] <= row['median_generation'] <= row['max_generation'])
+
+    def test_save_and_load_round_trip(self):
+
+        first_days = self.generation_data.filter(pl.col('settlementDate') < date(2024, 2, 3))
+        later_days = self.generation_data.filter(pl.col('settlementDate') >= date(2024, 2, 3))
+
+        with tempfile.TemporaryDirectory() as directory:
+            GenerationRollups(relative_accuracy=0.02).update(first_days).save(directory)
+            loaded = GenerationRollups.load(directory)
+
+        self.assertEqual(loaded.relative_accuracy, 0.02)
+
+        # A loaded state carries on merging exactly as the state that was saved would have
+        self.assert_rollups_equal(
+            loaded.update(later_days),
+            GenerationRollups(relative_accuracy=0.02).update(self.generation_data),
+        )
+
+    def test_load_without_saved_rollups_raises(self):
+        with tempfile.TemporaryDirectory() as directory, self.assertRaises(FileNotFoundError):
+            GenerationRollups.load(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
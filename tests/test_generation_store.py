@@ -0,0 +1,90 @@
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+
+import arrow
+import polars as pl
+
+from historic_generation_wrangler import GenerationStore, HistoricGenerationWrangler
+from http_transport import HttpTransport, StubServer
+
+# The stub publishes every fuel type every 5 minutes, and the generation pipeline drops the interconnectors and pumped storage
+READINGS_PER_DAY = 288 * 9
+
+
+class TestGenerationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.stub = StubServer().start()
+        self.wrangler = HistoricGenerationWrangler(transport=HttpTransport(base_urls=self.stub.base_urls), max_workers=2)
+        self.store = GenerationStore(Path(self.directory.name) / "store", self.wrangler)
+
+    def tearDown(self):
+        self.stub.stop()
+        self.directory.cleanup()
+
+    def get_partition_counts(self):
+        return dict(self.store.read_generation_data().group_by('settlementDate').len().iter_rows())
+
+    def assert_no_duplicate_readings(self):
+        stored = self.store.read_generation_data()
+        self.assertEqual(stored.height, stored.select(GenerationStore.MERGE_KEYS).unique().height)
+
+    def test_empty_store_needs_a_start_date(self):
+        with self.assertRaises(ValueError):
+            self.store.update(arrow.get('2024-01-03'))
+
+    def test_updates_resume_from_the_high_water_mark_and_merge_the_overlap(self):
+
+        first = self.store.update(arrow.get('2024-01-03'), start_date=arrow.get('2024-01-01'))
+
+        # Only whole settlement dates from start_date are stored, each with its own mark
+        self.assertEqual(self.get_partition_counts(), {date(2024, 1, 1): READINGS_PER_DAY, date(2024, 1, 2): READINGS_PER_DAY})
+        self.assertEqual(
+            self.store.get_high_water_marks()['publishTime'].to_list(),
+            [arrow.get('2024-01-02').datetime, arrow.get('2024-01-03').datetime],
+        )
+
+        # The next window starts at the mark, so the reading published at it is fetched again and merged, not duplicated
+        second = self.store.update(arrow.get('2024-01-03 12:00'))
+        self.assert_no_duplicate_readings()
+        self.assertEqual(self.get_partition_counts()[date(2024, 1, 3)], READINGS_PER_DAY // 2)
+
+        # Every stored reading is returned by exactly one update, so incremental consumers never count one twice
+        self.assertEqual(first.height + second.height, self.store.read_generation_data().height)
+        self.assertEqual(self.store.update(arrow.get('2024-01-03 12:00')).height, 0)
+
+    def test_start_date_before_the_stored_data_backfills_the_missing_partitions(self):
+
+        self.store.update(arrow.get('2024-01-06'), start_date=arrow.get('2024-01-04'))
+        backfilled = self.store.update(arrow.get('2024-01-06'), start_date=arrow.get('2024-01-01'))
+
+        self.assertEqual(
+            self.get_partition_counts(),
+            {date(2024, 1, day): READINGS_PER_DAY for day in range(1, 6)},
+        )
+        self.assertEqual(sorted(backfilled['settlementDate'].unique().to_list()), [date(2024, 1, day) for day in range(1, 4)])
+        self.assert_no_duplicate_readings()
+
+    def test_gap_between_stored_partitions_is_backfilled(self):
+
+        self.store.update(arrow.get('2024-01-06'), start_date=arrow.get('2024-01-01'))
+
+        # Losing a partition and its mark leaves a gap that the next update with a start_date fills
+        stored = self.store.read_generation_data().filter(pl.col('settlementDate') != date(2024, 1, 3))
+        marks = self.store.get_high_water_marks().filter(pl.col('settlementDate') != date(2024, 1, 3))
+        self.store.to_delta_types(stored).write_delta(self.store.generation_table_path, mode='overwrite')
+        marks.write_delta(self.store.high_water_marks_table_path, mode='overwrite')
+
+        backfilled = self.store.update(arrow.get('2024-01-06'), start_date=arrow.get('2024-01-01'))
+
+        self.assertEqual(backfilled['settlementDate'].unique().to_list(), [date(2024, 1, 3)])
+        self.assertEqual(backfilled.height, READINGS_PER_DAY)
+        self.assertEqual(self.get_partition_counts()[date(2024, 1, 3)], READINGS_PER_DAY)
+        self.assert_no_duplicate_readings()
+
+
+if __name__ == '__main__':
+    unittest.main()
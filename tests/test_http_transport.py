@@ -0,0 +1,96 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import arrow
+
+from historic_generation_wrangler import HistoricGenerationWrangler
+from http_transport import HttpTransport, StubServer
+from renewable_locations_wrangler import RenewableLocationsWrangler
+from weather_wrangler import WeatherWrangler
+
+# The small REPD spreadsheet recorded by benchmarks/make_fixtures.py, served as it is from its cassette body
+BENCHMARK_CASSETTES = HttpTransport("replay", Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures" / "cassettes")
+_, REPD_XLSX = BENCHMARK_CASSETTES.get_cassette_paths(
+    BENCHMARK_CASSETTES.get_request_key("GET", RenewableLocationsWrangler().gov_uk_url)
+)
+
+API_KEY = "stub-api-key"
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cassette_dir = Path(self.directory.name) / "cassettes"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_frames(self, transport, cache_dir=None):
+        start_date, end_date = arrow.get("2024-01-01"), arrow.get("2024-01-15")
+        return {
+            "generation": HistoricGenerationWrangler(transport=transport, max_workers=2).get_generation_data(start_date, end_date, window_days=7),
+            "locations": RenewableLocationsWrangler(transport=transport, cache_dir=cache_dir).load_data(),
+            # The timestamp column records when the response was parsed, so it differs between any two runs
+            "weather": WeatherWrangler(api_key=API_KEY, transport=transport)
+                .get_historical_weather_data_batch([(56.0, -3.8, "2024-01-01", "2024-01-03"), (52.5, 1.5, "2024-01-01", "2024-01-03")])
+                .drop("timestamp"),
+        }
+
+    def test_replay_returns_the_recorded_frames(self):
+
+        with StubServer(repd_path=REPD_XLSX) as stub:
+            recorded = self.get_frames(HttpTransport("record", self.cassette_dir, base_urls=stub.base_urls))
+
+        # The stub is stopped, so anything not answered from the cassettes fails
+        replayed = self.get_frames(HttpTransport("replay", self.cassette_dir))
+
+        for name, frame in recorded.items():
+            with self.subTest(frame=name):
+                self.assertGreater(frame.height, 0)
+                self.assertTrue(frame.equals(replayed[name]), f"Replayed {name} differs from the recording")
+
+    def test_replay_revalidates_a_warm_repd_cache_without_a_recorded_head(self):
+
+        # A cold cache only ever makes the GET, so the warm run's HEAD has no recording to replay
+        cache_dir = Path(self.directory.name) / "repd"
+        with StubServer(repd_path=REPD_XLSX) as stub:
+            recorded = RenewableLocationsWrangler(
+                transport=HttpTransport("record", self.cassette_dir, base_urls=stub.base_urls), cache_dir=cache_dir
+            ).load_data()
+
+        replayed = RenewableLocationsWrangler(transport=HttpTransport("replay", self.cassette_dir), cache_dir=cache_dir).load_data()
+
+        self.assertTrue(recorded.equals(replayed))
+
+    def test_replay_without_a_recording_raises(self):
+        transport = HttpTransport("replay", self.cassette_dir)
+        with self.assertRaises(FileNotFoundError):
+            transport.get("https://data.elexon.co.uk/bmrs/api/v1/datasets/FUELINST/stream", params={"publishDateTimeFrom": "2024-01-01T00:00:00Z"})
+
+    def test_request_key_ignores_parameter_order_and_placement(self):
+        transport = HttpTransport("replay", self.cassette_dir)
+        url = "https://api.stormglass.io/v2/weather/point"
+
+        key = transport.get_request_key("get", url, {"lat": 56.0, "lng": -3.8})
+        self.assertEqual(key, transport.get_request_key("GET", url, {"lng": -3.8, "lat": 56.0}))
+        self.assertEqual(key, transport.get_request_key("GET", url + "?lng=-3.8", {"lat": 56.0}))
+        self.assertNotEqual(key[0], transport.get_request_key("HEAD", url, {"lat": 56.0, "lng": -3.8})[0])
+
+    def test_recording_never_saves_the_api_key(self):
+
+        with StubServer() as stub:
+            WeatherWrangler(api_key=API_KEY, transport=HttpTransport("record", self.cassette_dir, base_urls=stub.base_urls)) \
+                .get_historical_weather_data(56.0, -3.8, "2024-01-01", "2024-01-02")
+
+        for path in self.cassette_dir.iterdir():
+            self.assertNotIn(API_KEY.encode("utf-8"), path.read_bytes(), f"API key written to {path.name}")
+
+        metadata = [json.loads(path.read_text()) for path in self.cassette_dir.glob("*.json")]
+        self.assertEqual([entry["request"]["method"] for entry in metadata], ["GET"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+from datetime import datetime
+
+import arrow
+import polars as pl
+
+from weather_wrangler import WeatherCache
+
+LATITUDE, LONGITUDE = 56.0021, -3.78535
+
+
+def make_weather_data(start, end):
+    # Hourly observations from start to end inclusive, in the layout parse_stormglass_response returns
+    times = pl.datetime_range(start, end, '1h', eager=True, time_unit='us')
+    return pl.DataFrame({'time': times, 'windSpeed': [float(hour) for hour in range(len(times))]})
+
+
+class TestWeatherCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = WeatherCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def store(self, start, end, weather_data):
+        self.cache.store(LATITUDE, LONGITUDE, arrow.get(start), arrow.get(end), weather_data)
+
+    def get_missing_ranges(self, start, end):
+        return [
+            (missing_start.datetime.replace(tzinfo=None), missing_end.datetime.replace(tzinfo=None))
+            for missing_start, missing_end in self.cache.get_missing_ranges(LATITUDE, LONGITUDE, arrow.get(start), arrow.get(end))
+        ]
+
+    def test_empty_cache_is_missing_the_whole_range(self):
+        self.assertEqual(
+            self.get_missing_ranges(datetime(2024, 1, 1), datetime(2024, 1, 2)),
+            [(datetime(2024, 1, 1), datetime(2024, 1, 2))],
+        )
+
+    def test_gaps_between_covered_ranges_are_missing(self):
+
+        self.store(datetime(2024, 1, 1, 6), datetime(2024, 1, 1, 11), make_weather_data(datetime(2024, 1, 1, 6), datetime(2024, 1, 1, 11)))
+        self.store(datetime(2024, 1, 1, 15), datetime(2024, 1, 1, 17), make_weather_data(datetime(2024, 1, 1, 15), datetime(2024, 1, 1, 17)))
+
+        self.assertEqual(
+            self.get_missing_ranges(datetime(2024, 1, 1), datetime(2024, 1, 1, 23)),
+            [
+                (datetime(2024, 1, 1), datetime(2024, 1, 1, 5)),
+                (datetime(2024, 1, 1, 12), datetime(2024, 1, 1, 14)),
+                (datetime(2024, 1, 1, 18), datetime(2024, 1, 1, 23)),
+            ],
+        )
+        self.assertEqual(self.get_missing_ranges(datetime(2024, 1, 1, 7), datetime(2024, 1, 1, 10)), [])
+
+        # Filling the gap merges the three covered ranges into one
+        self.store(datetime(2024, 1, 1, 12), datetime(2024, 1, 1, 14), make_weather_data(datetime(2024, 1, 1, 12), datetime(2024, 1, 1, 14)))
+        self.assertEqual(len(self.cache.read_coverage(LATITUDE, LONGITUDE)), 1)
+        self.assertEqual(self.cache.load(LATITUDE, LONGITUDE, arrow.get(datetime(2024, 1, 1)), arrow.get(datetime(2024, 1, 2))).height, 12)
+
+    def test_only_the_hours_returned_are_covered(self):
+
+        # A short response leaves the hours it did not return to be fetched again
+        self.store(datetime(2024, 1, 1), datetime(2024, 1, 1, 23), make_weather_data(datetime(2024, 1, 1, 3), datetime(2024, 1, 1, 20)))
+
+        self.assertEqual(
+            self.get_missing_ranges(datetime(2024, 1, 1), datetime(2024, 1, 1, 23)),
+            [(datetime(2024, 1, 1), datetime(2024, 1, 1, 2)), (datetime(2024, 1, 1, 21), datetime(2024, 1, 1, 23))],
+        )
+
+    def test_empty_response_covers_nothing(self):
+        self.store(datetime(2024, 1, 1), datetime(2024, 1, 1, 23), make_weather_data(datetime(2024, 1, 1), datetime(2024, 1, 1)).clear())
+        self.assertEqual(self.cache.read_coverage(LATITUDE, LONGITUDE), [])
+
+    def test_hours_after_now_are_never_covered(self):
+
+        now = arrow.utcnow().floor('hour')
+        weather_data = make_weather_data(now.shift(hours=-2).naive, now.shift(hours=5).naive)
+        self.store(now.shift(hours=-2), now.shift(hours=5), weather_data)
+
+        self.assertEqual(self.cache.read_coverage(LATITUDE, LONGITUDE), [(now.shift(hours=-2), now)])
+
+    def test_nearby_points_share_an_entry(self):
+        self.store(datetime(2024, 1, 1), datetime(2024, 1, 1, 5), make_weather_data(datetime(2024, 1, 1), datetime(2024, 1, 1, 5)))
+        self.assertEqual(
+            self.cache.get_missing_ranges(LATITUDE + 0.001, LONGITUDE - 0.001, arrow.get(datetime(2024, 1, 1)), arrow.get(datetime(2024, 1, 1, 5))),
+            [],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
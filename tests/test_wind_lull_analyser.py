@@ -0,0 +1,84 @@
+import unittest
+from datetime import datetime
+
+import polars as pl
+
+from wind_analytics import WindLullAnalyser
+
+
+def make_wind_series(start, end, lulls, missing=()):
+
+    # 5 minute readings at a capacity factor of 0.5, dropping to 0.05 inside each lull and left out where missing
+    times = pl.datetime_range(start, end, '5m', eager=True, time_unit='us')
+    value = pl.lit(0.5)
+    for lull_start, lull_end in lulls:
+        value = pl.when(pl.col('time').is_between(lull_start, lull_end, closed='left')).then(0.05).otherwise(value)
+
+    return (
+        pl.DataFrame({'time': times})
+        .filter(~pl.col('time').is_in(list(missing)))
+        .with_columns(value.alias('capacity_factor'), (value / 2).alias('demand_share'))
+    )
+
+
+class TestWindLullAnalyser(unittest.TestCase):
+
+    def setUp(self):
+        # One lull across the new year, which is cut between the 2023 and 2024 partitions, and one inside 2024
+        self.wind_series = make_wind_series(
+            datetime(2023, 12, 31, 12),
+            datetime(2024, 1, 1, 12),
+            lulls=[(datetime(2023, 12, 31, 22), datetime(2024, 1, 1, 2)), (datetime(2024, 1, 1, 6), datetime(2024, 1, 1, 7))],
+        )
+
+    def assert_lulls_across_the_year_end_are_stitched(self, analyser):
+
+        lulls = analyser.find_lulls(self.wind_series)
+
+        self.assertEqual(lulls.height, 2)
+        first = lulls.row(0, named=True)
+        self.assertEqual((first['start'], first['end']), (datetime(2023, 12, 31, 22), datetime(2024, 1, 1, 2)))
+        self.assertEqual(first['periods'], 48)
+        self.assertAlmostEqual(first['duration_hours'], 4)
+        self.assertAlmostEqual(first['mean_capacity_factor'], 0.05)
+        self.assertAlmostEqual(first['min_capacity_factor'], 0.05)
+
+    def test_lulls_are_stitched_across_year_partitions(self):
+        self.assert_lulls_across_the_year_end_are_stitched(WindLullAnalyser(max_workers=1))
+
+    def test_lulls_are_stitched_across_partitions_found_in_worker_processes(self):
+        self.assert_lulls_across_the_year_end_are_stitched(WindLullAnalyser(max_workers=2))
+
+    def test_missing_reading_splits_a_lull(self):
+        wind_series = make_wind_series(
+            datetime(2024, 1, 1),
+            datetime(2024, 1, 1, 6),
+            lulls=[(datetime(2024, 1, 1, 1), datetime(2024, 1, 1, 3))],
+            missing=[datetime(2024, 1, 1, 2)],
+        )
+
+        lulls = WindLullAnalyser(max_workers=1).find_lulls(wind_series)
+
+        self.assertEqual(lulls['start'].to_list(), [datetime(2024, 1, 1, 1), datetime(2024, 1, 1, 2, 5)])
+        self.assertEqual(lulls['periods'].to_list(), [12, 11])
+
+    def test_min_duration_applies_to_the_stitched_lull(self):
+        # Neither half of the new year lull is 3 hours long on its own side of the partition boundary
+        lulls = WindLullAnalyser(max_workers=1, min_duration='3h').find_lulls(self.wind_series)
+        self.assertEqual(lulls['start'].to_list(), [datetime(2023, 12, 31, 22)])
+
+    def test_capacity_scale_only_applies_to_demand_share(self):
+
+        with self.assertRaises(ValueError):
+            WindLullAnalyser(max_workers=1).scan(self.wind_series, thresholds=[0.1], capacity_scales=[2.0])
+
+        # Doubling the fleet doubles wind's share of demand, lifting the 0.025 lulls over a 0.04 threshold
+        lulls = WindLullAnalyser(metric='demand_share', max_workers=1).scan(
+            self.wind_series, thresholds=[0.04], capacity_scales=[1.0, 2.0]
+        )
+        self.assertEqual(lulls.filter(pl.col('capacity_scale') == 1.0).height, 2)
+        self.assertEqual(lulls.filter(pl.col('capacity_scale') == 2.0).height, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
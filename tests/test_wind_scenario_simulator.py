@@ -0,0 +1,96 @@
+import unittest
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+from wind_analytics import WindScenarioSimulator
+
+
+def simulate_reading_by_reading(capacity_factor, demand_mw, capacity_mw, storage_mwh, simulator):
+
+    # The plain loop the block composition has to reproduce, one reading and one scenario at a time
+    state = storage_mwh * simulator.initial_state_of_charge
+    min_state = state
+    unserved = curtailed = 0.0
+    shortfall_periods = 0
+    for factor, demand in zip(capacity_factor, demand_mw):
+        flow = (factor * capacity_mw - demand) * simulator.resolution_hours
+        if flow > 0:
+            flow *= simulator.round_trip_efficiency
+        next_state = min(max(state + flow, 0.0), storage_mwh)
+        residual = flow - (next_state - state)
+        unserved += max(-residual, 0.0)
+        curtailed += max(residual, 0.0) / simulator.round_trip_efficiency
+        shortfall_periods += residual < -1e-9
+        state = next_state
+        min_state = min(min_state, state)
+
+    return {
+        'unserved_energy_mwh': unserved,
+        'shortfall_periods': shortfall_periods,
+        'curtailed_energy_mwh': curtailed,
+        'min_state_of_charge': min_state / storage_mwh if storage_mwh > 0 else np.nan,
+        'final_state_of_charge': state / storage_mwh if storage_mwh > 0 else np.nan,
+    }
+
+
+class TestWindScenarioSimulator(unittest.TestCase):
+
+    def setUp(self):
+        # A week of 5 minute readings with demand sometimes above and sometimes below what the scenarios generate
+        generator = np.random.default_rng(0)
+        readings = 2016
+        self.wind_series = pl.DataFrame({
+            'time': pl.datetime_range(datetime(2024, 1, 1), datetime(2024, 1, 7, 23, 55), '5m', eager=True),
+            'capacity_factor': np.clip(0.35 + 0.3 * np.sin(np.arange(readings) / 150) + generator.normal(0, 0.1, readings), 0, 1),
+            'total_generation_mw': 30000 + 5000 * np.sin(np.arange(readings) / 40) + generator.normal(0, 500, readings),
+        })
+        self.capacities_mw = [40000.0, 80000.0, 120000.0]
+        self.storage_mwh = [0.0, 5000.0, 50000.0]
+
+    def assert_matches_reference(self, simulator):
+
+        results = simulator.simulate_grid(self.wind_series, self.capacities_mw, self.storage_mwh)
+
+        capacity_factor = self.wind_series['capacity_factor'].to_numpy()
+        demand_mw = self.wind_series['total_generation_mw'].to_numpy()
+        for row in results.iter_rows(named=True):
+            expected = simulate_reading_by_reading(capacity_factor, demand_mw, row['capacity_mw'], row['storage_mwh'], simulator)
+            for column, value in expected.items():
+                with self.subTest(capacity_mw=row['capacity_mw'], storage_mwh=row['storage_mwh'], column=column):
+                    np.testing.assert_allclose(row[column], value, rtol=1e-9, atol=1e-6)
+
+    def test_simulation_matches_the_reading_by_reading_reference(self):
+        self.assert_matches_reference(WindScenarioSimulator())
+
+    def test_simulation_in_small_chunks_matches_the_reference(self):
+        # 63 cells over 9 scenarios walks the series 7 readings at a time, carrying the state across 288 chunks
+        self.assert_matches_reference(WindScenarioSimulator(max_elements=63, initial_state_of_charge=0.5))
+
+    def test_scan_state_of_charge_matches_clipping_each_reading(self):
+
+        simulator = WindScenarioSimulator()
+        generator = np.random.default_rng(1)
+        storage_mwh = np.array([0.0, 1.0, 10.0, 100.0])
+
+        # Lengths either side of a square number, so the padding of the last block is exercised
+        for readings in (1, 2, 15, 16, 17, 99):
+            with self.subTest(readings=readings):
+                flows = generator.normal(0, 5, (readings, len(storage_mwh)))
+                state = storage_mwh / 2
+
+                states, final_state = simulator.scan_state_of_charge(flows.copy(), storage_mwh, state.copy())
+
+                expected = np.empty_like(flows)
+                current = state.copy()
+                for position in range(readings):
+                    current = np.clip(current + flows[position], 0, storage_mwh)
+                    expected[position] = current
+
+                np.testing.assert_allclose(states, expected, atol=1e-9)
+                np.testing.assert_allclose(final_state, expected[-1], atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()